@@ -0,0 +1,285 @@
+"""Calibration module contains a flash-backed moisture sensor calibration
+table, which converts raw ADC readings to volumetric moisture percentage.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Functions:
+    min_max_scale_reading
+
+Classes:
+    CalibrationTable: Per-sensor moisture calibration table file.
+
+Constants:
+    MAX_POINTS (int): Maximum calibration curve points per sensor.
+"""
+
+import array
+import struct
+from micropython import const
+from .sampling import CHANNELS
+
+# magic, version, channels, points per channel
+_HEADER = "<2sBBB"
+_HEADER_SIZE = const(5)
+_MAGIC = b"CT"
+_VERSION = const(2)
+
+MAX_POINTS = const(8)
+
+# dry u16, wet u16, endpoint flags, curve point count
+_SENSOR = "<HHBB"
+_SENSOR_SIZE = const(6)
+# endpoint flags: dry endpoint captured, wet endpoint captured
+_DRY = const(0x01)
+_WET = const(0x02)
+# reading u16, moisture (0.01 %)
+_POINT = "<HH"
+_POINT_SIZE = const(4)
+
+_FILE_SIZE = const(
+    _HEADER_SIZE + CHANNELS * (_SENSOR_SIZE + MAX_POINTS * _POINT_SIZE)
+)
+
+_NAN = float("nan")
+
+
+def min_max_scale_reading(value: float, min: int, max: int) -> float:
+    """Scale a reading to lie between a given minimum and maximum value.
+    If a moisture sensor reading, along with its calibration min and max 
+    values are passed, the value will be scaled between 0 & 1.
+
+    NOTE: The scaled value * 100 would give the percentage.
+
+    Args:
+        value (float): Reading value.
+        min (int): Minimum reading value.
+        max (int): Maximum reading value.
+
+    Returns:
+        float: Value scaled between 0 & 1
+    """
+    # value will now lie between min & max - i.e. 0 - 1
+    value_scaled = (value - min) / (max - min) 
+    return value_scaled
+
+
+class CalibrationTable:
+    """Moisture calibration of each analog sensor, as dry & wet ADC
+    endpoints and an optional piecewise-linear curve, kept in a small
+    file on the Pico filesystem.
+
+    Readings are converted to moisture percentage by the curve, if the
+    sensor has at least two curve points, or otherwise scaled linearly
+    between the dry (0 %) & wet (100 %) endpoints. Readings outside the
+    curve are extrapolated from its end segments. Moisture is clamped to
+    0 - 100 %, and is NaN for an uncalibrated sensor, or one without both
+    endpoints captured.
+
+    Endpoints & curve points are held in preallocated arrays, with curve
+    points kept in reading order. convert fills the moisture array for a
+    whole scan in one pass, indexed by sensor number as the
+    MoistureSampler result arrays.
+
+    File layout (little endian):
+        header (5 bytes):
+            magic (2s), version (u8), channels (u8), points per channel (u8)
+        sensors (38 bytes each):
+            dry u16 (u16), wet u16 (u16), endpoint flags (u8, dry 0x01,
+            wet 0x02), curve point count (u8),
+            points (4 bytes each): reading u16 (u16), moisture 0.01 % (u16)
+
+    Args:
+        path (str, optional): Calibration table file path.
+    """
+
+    def __init__(self, path: str = "calibration.bin"):
+        self.path = path
+        self.dry = array.array("H", bytes(2 * CHANNELS))
+        self.wet = array.array("H", bytes(2 * CHANNELS))
+        self.endpoints = bytearray(CHANNELS)
+        self.points = bytearray(CHANNELS)
+        self.curve_u16 = array.array("H", bytes(2 * CHANNELS * MAX_POINTS))
+        self.curve_moisture = array.array("f", bytes(4 * CHANNELS * MAX_POINTS))
+        self.moisture = array.array("f", bytes(4 * CHANNELS))
+        self._buffer = bytearray(_FILE_SIZE)
+        self.load()
+
+    def load(self) -> bool:
+        """Load the calibration table file, if it exists with this layout.
+
+        Returns:
+            True if the table was loaded.
+        """
+        buffer = self._buffer
+        try:
+            with open(self.path, "rb") as f:
+                if f.readinto(buffer) != _FILE_SIZE:
+                    return False
+        except OSError:
+            return False
+        magic, version, channels, points = struct.unpack_from(_HEADER, buffer)
+        if (
+            magic != _MAGIC or version != _VERSION
+            or channels != CHANNELS or points != MAX_POINTS
+        ):
+            return False
+
+        i = _HEADER_SIZE
+        for n in range(CHANNELS):
+            self.dry[n], self.wet[n], self.endpoints[n], count = struct.unpack_from(
+                _SENSOR, buffer, i
+            )
+            self.points[n] = min(count, MAX_POINTS)
+            i += _SENSOR_SIZE
+            for j in range(n * MAX_POINTS, (n + 1) * MAX_POINTS):
+                reading, moisture = struct.unpack_from(_POINT, buffer, i)
+                self.curve_u16[j] = reading
+                self.curve_moisture[j] = moisture / 100
+                i += _POINT_SIZE
+        return True
+
+    def save(self) -> None:
+        """Write the calibration table file."""
+        buffer = self._buffer
+        struct.pack_into(_HEADER, buffer, 0, _MAGIC, _VERSION, CHANNELS, MAX_POINTS)
+        i = _HEADER_SIZE
+        for n in range(CHANNELS):
+            struct.pack_into(
+                _SENSOR, buffer, i, self.dry[n], self.wet[n],
+                self.endpoints[n], self.points[n]
+            )
+            i += _SENSOR_SIZE
+            for j in range(n * MAX_POINTS, (n + 1) * MAX_POINTS):
+                struct.pack_into(
+                    _POINT, buffer, i, self.curve_u16[j],
+                    round(self.curve_moisture[j] * 100)
+                )
+                i += _POINT_SIZE
+        with open(self.path, "wb") as f:
+            f.write(buffer)
+
+    def capture(self, sensor: int, point: str | float, reading: int) -> None:
+        """Set a calibration point of a sensor from a reading. The table
+        is not saved.
+
+        Args:
+            sensor (int): Analog sensor 0 - 2.
+            point (str | float): "dry" or "wet" endpoint, "clear" to remove
+                the sensor calibration, or a curve point moisture %.
+            reading (int): ADC u16 reading.
+
+        Raises:
+            ValueError: If the point is invalid, or the curve is full.
+        """
+        if point == "dry":
+            self.dry[sensor] = reading
+            self.endpoints[sensor] |= _DRY
+        elif point == "wet":
+            self.wet[sensor] = reading
+            self.endpoints[sensor] |= _WET
+        elif point == "clear":
+            self.dry[sensor] = self.wet[sensor] = 0
+            self.endpoints[sensor] = 0
+            self.points[sensor] = 0
+        elif isinstance(point, (int, float)) and 0 <= point <= 100:
+            self._insert(sensor, reading, point)
+        else:
+            raise ValueError(f"Invalid calibration point {point}")
+
+    def _insert(self, sensor: int, reading: int, moisture: float) -> None:
+        """Insert a curve point in reading order, replacing any point of
+        the same reading."""
+        curve_u16, curve_moisture = self.curve_u16, self.curve_moisture
+        base = sensor * MAX_POINTS
+        end = base + self.points[sensor]
+        i = base
+        while i < end and curve_u16[i] < reading:
+            i += 1
+        if i == end or curve_u16[i] != reading:
+            if end == base + MAX_POINTS:
+                raise ValueError(f"Calibration curve of sensor {sensor} is full")
+            for j in range(end, i, -1):
+                curve_u16[j] = curve_u16[j - 1]
+                curve_moisture[j] = curve_moisture[j - 1]
+            self.points[sensor] += 1
+        curve_u16[i] = reading
+        curve_moisture[i] = moisture
+
+    def convert(self, readings: array.array, channels: tuple = (0, 1, 2)) -> array.array:
+        """Convert the readings of a scan to moisture percentage, into the
+        moisture array.
+
+        Args:
+            readings (array): Readings indexed by sensor number, such as
+                MoistureSampler.mean.
+            channels (tuple, optional): Analog sensors 0 - 2 to convert.
+
+        Returns:
+            The moisture array, indexed by sensor number.
+        """
+        moisture = self.moisture
+        dry, wet, points = self.dry, self.wet, self.points
+        endpoints = self.endpoints
+        for n in channels:
+            value = readings[n]
+            if points[n] >= 2:
+                m = self._interpolate(n, value)
+            elif endpoints[n] == _DRY | _WET and dry[n] != wet[n]:
+                m = min_max_scale_reading(value, dry[n], wet[n]) * 100
+            else:
+                moisture[n] = _NAN
+                continue
+            moisture[n] = 0.0 if m < 0 else 100.0 if m > 100 else m
+        return moisture
+
+    def _interpolate(self, sensor: int, value: float) -> float:
+        """Interpolate a reading on the calibration curve of a sensor,
+        extrapolating from the end segments."""
+        curve_u16, curve_moisture = self.curve_u16, self.curve_moisture
+        i = sensor * MAX_POINTS
+        last = i + self.points[sensor] - 1
+        # segment (i, i + 1) containing value, or an end segment
+        while i < last - 1 and value > curve_u16[i + 1]:
+            i += 1
+        x0, x1 = curve_u16[i], curve_u16[i + 1]
+        y0, y1 = curve_moisture[i], curve_moisture[i + 1]
+        return y0 + (value - x0) * (y1 - y0) / (x1 - x0)
+
+    def describe(self, sensor: int) -> dict:
+        """Get the calibration of a sensor, for command responses.
+
+        Args:
+            sensor (int): Analog sensor 0 - 2.
+
+        Returns:
+            A dict of the "dry" & "wet" endpoints (None if not captured)
+            and "curve" points, as [reading u16, moisture %] pairs.
+        """
+        base = sensor * MAX_POINTS
+        endpoints = self.endpoints[sensor]
+        return {
+            "sensor-id": sensor,
+            "dry": self.dry[sensor] if endpoints & _DRY else None,
+            "wet": self.wet[sensor] if endpoints & _WET else None,
+            "curve": [
+                [self.curve_u16[i], self.curve_moisture[i]]
+                for i in range(base, base + self.points[sensor])
+            ],
+        }
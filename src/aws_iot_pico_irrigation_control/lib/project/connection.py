@@ -42,6 +42,7 @@ import machine
 import network
 import ssl
 from time import sleep
+from umqtt.aio import MQTTClient as AsyncMQTTClient
 from umqtt.robust import MQTTClient
 from .utility import debug_message, dynamic_get_secret, dynamic_set_secret
 
@@ -348,11 +349,19 @@ def get_context(verbose : bool = False) -> ssl.SSLContext:
         return context
 
 
-def get_client_interface(verbose : bool = False) -> MQTTClient:
+def get_client_interface(
+        verbose : bool = False,
+        asynchronous: bool = True
+    ) -> AsyncMQTTClient | MQTTClient:
     """Get an MQTT client instance.
 
+    The asyncio client is returned by default, which performs all socket
+    I/O through asyncio streams. The blocking umqtt.robust client remains
+    available as a fallback by setting asynchronous to False.
+
     Args:
         verbose (bool, optional): Enable verbose debug messages.
+        asynchronous (bool, optional): Return the asyncio MQTT client.
 
     Raises:
         MQTTSecretsError: If MQTT secrets not in ./env/secrets.
@@ -360,7 +369,7 @@ def get_client_interface(verbose : bool = False) -> MQTTClient:
         FileNotFoundError: If SSL certificates not in ./certs.
 
     Returns:
-        umqtt.robust.MQTTClient
+        umqtt.aio.MQTTClient | umqtt.robust.MQTTClient
     """
 
     try:
@@ -371,12 +380,24 @@ def get_client_interface(verbose : bool = False) -> MQTTClient:
         
         context = get_context(verbose)
 
-        mqtt_client = MQTTClient(
+        client_type = (MQTTClient, AsyncMQTTClient)[asynchronous]
+        mqtt_client = client_type(
             client_id=MQTT_CLIENT_ID,
             server=MQTT_ENDPOINT,
             port=8883,
-            keepalive=5000,
+            # the asyncio client sends PINGREQ from its keepalive Task
+            keepalive=(5000, 60)[asynchronous],
             ssl=context,
+            max_inflight=8,
+            # command messages larger than 1 KB are discarded, unless a
+            # chunk callback is set to stream them in 128 byte pieces
+            max_payload=1024,
+            chunk_size=128,
+            # MQTT 5.0, with recurring topics sent as 2 byte topic aliases
+            # & the session kept for an hour after the connection is lost
+            version=5,
+            session_expiry=3600,
+            topic_aliases=8,
         )
         gc.collect()
         # debug_message("MQTT CLIENT INITIALISED", verbose)
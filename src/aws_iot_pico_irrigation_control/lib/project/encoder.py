@@ -0,0 +1,223 @@
+"""Encoder module contains a JSON encoder, which serialises a message
+straight into a caller supplied buffer, such as the packet buffer of the
+MQTT client, without building intermediate str or bytes objects.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    JSONPayload: JSON message payload with a known encoded size.
+"""
+
+import json
+from micropython import const
+
+_NULL = b"null"
+_TRUE = b"true"
+_FALSE = b"false"
+
+_HEX = b"0123456789abcdef"
+
+# encoded dict keys are cached up to this count, string values are
+# escaped straight into the buffer, as many (such as session ids) never
+# recur
+_CACHE_SIZE = const(64)
+_keys = {}
+
+
+def _key(s: str) -> bytes:
+    """Get the quoted & escaped JSON encoding of a dict key, cached."""
+    encoded = _keys.get(s)
+    if encoded is None:
+        encoded = json.dumps(s).encode()
+        if len(_keys) < _CACHE_SIZE:
+            _keys[s] = encoded
+    return encoded
+
+
+class JSONPayload:
+    """JSON encoded MQTT message payload, which is serialised into the
+    MQTT client packet buffer as the PUBLISH packet is built.
+
+    The encoded size is computed when the message is set, without
+    encoding it, so the MQTT client can write the remaining length header
+    before the payload is encoded after it. Dict keys are encoded once and
+    cached, while string values are escaped and numbers are written digit
+    by digit.
+
+    Floats are written with a fixed number of decimal places. NaN and
+    infinite floats are written as null.
+
+    NOTE: A QoS 1 message is encoded again if it is retransmitted, so the
+    message must not be changed until it has been acknowledged.
+
+    Args:
+        message (dict | list, optional): Message of dict, list, tuple, str,
+            int, float, bool & None values.
+        precision (int, optional): Decimal places of float values.
+    """
+
+    def __init__(self, message: dict | list | None = None, precision: int = 4):
+        self.precision = precision
+        self._scale = 10 ** precision
+        self.message = None
+        self.size = 0
+        self.set(message)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def set(self, message: dict | list | None) -> "JSONPayload":
+        """Set the message and compute its encoded size.
+
+        Args:
+            message (dict | list): Message to encode.
+
+        Returns:
+            The JSONPayload instance.
+        """
+        self.message = message
+        self.size = self._encode(message, None, 0)
+        return self
+
+    def pack_into(self, buffer: bytearray, offset: int = 0) -> int:
+        """Encode the message into buffer at offset.
+
+        Args:
+            buffer (bytearray): Buffer with at least len(self) bytes free
+                from offset.
+            offset (int, optional): Buffer offset.
+
+        Returns:
+            Buffer offset after the encoded message.
+        """
+        return self._encode(self.message, buffer, offset)
+
+    def _encode(self, value, buffer: bytearray | None, i: int) -> int:
+        """Encode value into buffer at i, or only count its size if buffer
+        is None, so that both always agree. Returns the offset after it."""
+        if value is None or value is True or value is False:
+            token = _NULL if value is None else _TRUE if value else _FALSE
+            return self._put(buffer, i, token)
+        if isinstance(value, int):
+            return self._put_int(buffer, i, value)
+        if isinstance(value, float):
+            return self._put_float(buffer, i, value)
+        if isinstance(value, str):
+            return self._put_str(buffer, i, value)
+        if isinstance(value, dict):
+            i = self._put_byte(buffer, i, 0x7B)  # {
+            first = True
+            for key, item in value.items():
+                if not first:
+                    i = self._put_byte(buffer, i, 0x2C)  # ,
+                first = False
+                i = self._put(buffer, i, _key(key))
+                i = self._put_byte(buffer, i, 0x3A)  # :
+                i = self._encode(item, buffer, i)
+            return self._put_byte(buffer, i, 0x7D)  # }
+        if isinstance(value, (list, tuple)):
+            i = self._put_byte(buffer, i, 0x5B)  # [
+            first = True
+            for item in value:
+                if not first:
+                    i = self._put_byte(buffer, i, 0x2C)  # ,
+                first = False
+                i = self._encode(item, buffer, i)
+            return self._put_byte(buffer, i, 0x5D)  # ]
+        raise TypeError(f"Unsupported JSON type {type(value)}")
+
+    @staticmethod
+    def _put(buffer: bytearray | None, i: int, data: bytes) -> int:
+        if buffer is not None:
+            buffer[i : i + len(data)] = data
+        return i + len(data)
+
+    @staticmethod
+    def _put_byte(buffer: bytearray | None, i: int, byte: int) -> int:
+        if buffer is not None:
+            buffer[i] = byte
+        return i + 1
+
+    @staticmethod
+    def _put_str(buffer: bytearray | None, i: int, s: str) -> int:
+        """Write s quoted, as UTF-8 with '"', '\\' & control characters
+        escaped."""
+        put = JSONPayload._put_byte
+        i = put(buffer, i, 0x22)  # "
+        for c in s:
+            o = ord(c)
+            if o == 0x22 or o == 0x5C:  # " \
+                i = put(buffer, i, 0x5C)
+                i = put(buffer, i, o)
+            elif o < 0x20:  # \u00XX
+                i = JSONPayload._put(buffer, i, b"\\u00")
+                i = put(buffer, i, _HEX[o >> 4])
+                i = put(buffer, i, _HEX[o & 0xF])
+            elif o < 0x80:
+                i = put(buffer, i, o)
+            elif o < 0x800:
+                i = put(buffer, i, 0xC0 | o >> 6)
+                i = put(buffer, i, 0x80 | o & 0x3F)
+            elif o < 0x10000:
+                i = put(buffer, i, 0xE0 | o >> 12)
+                i = put(buffer, i, 0x80 | o >> 6 & 0x3F)
+                i = put(buffer, i, 0x80 | o & 0x3F)
+            else:
+                i = put(buffer, i, 0xF0 | o >> 18)
+                i = put(buffer, i, 0x80 | o >> 12 & 0x3F)
+                i = put(buffer, i, 0x80 | o >> 6 & 0x3F)
+                i = put(buffer, i, 0x80 | o & 0x3F)
+        return put(buffer, i, 0x22)  # "
+
+    @staticmethod
+    def _put_digits(buffer: bytearray | None, i: int, n: int, width: int = 1) -> int:
+        """Write non-negative n as at least width decimal digits."""
+        count = 1
+        m = n
+        while m >= 10:
+            m //= 10
+            count += 1
+        count = max(count, width)
+        if buffer is not None:
+            j = i + count
+            for _ in range(count):
+                j -= 1
+                buffer[j] = 0x30 + n % 10
+                n //= 10
+        return i + count
+
+    def _put_int(self, buffer: bytearray | None, i: int, n: int) -> int:
+        if n < 0:
+            i = self._put_byte(buffer, i, 0x2D)  # -
+            n = -n
+        return self._put_digits(buffer, i, n)
+
+    def _put_float(self, buffer: bytearray | None, i: int, x: float) -> int:
+        # NaN & infinite floats, which have no JSON representation
+        if x - x != 0:
+            return self._put(buffer, i, _NULL)
+        scaled = round(abs(x) * self._scale)
+        if x < 0 and scaled:
+            i = self._put_byte(buffer, i, 0x2D)  # -
+        i = self._put_digits(buffer, i, scaled // self._scale)
+        if not self.precision:
+            return i
+        i = self._put_byte(buffer, i, 0x2E)  # .
+        return self._put_digits(buffer, i, scaled % self._scale, self.precision)
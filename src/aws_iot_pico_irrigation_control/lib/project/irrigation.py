@@ -6,23 +6,47 @@ Author: Andrew Ridyard.
 
 License: GNU General Public License v3 or later.
 
+Classes:
+    ReadingCache
+
 Functions:
     activate_solenoid
-    min_max_scale_reading
+    format_moisture_reading
+    get_sampler
     read_moisture_sensor
+    scan_moisture_sensors
 """
 
-import array
 import asyncio
 import time
-from machine import ADC, Pin, RTC
-from micropython import const
+from machine import Pin
+# min_max_scale_reading moved to the calibration module, re-exported here
+from .calibration import CalibrationTable, min_max_scale_reading
+from .sampling import CHANNELS, MoistureSampler
 from .utility import debug_message
 
+_sampler = None
+
+
+def get_sampler() -> MoistureSampler:
+    """Get the default MoistureSampler, created on first use.
+
+    Returns:
+        MoistureSampler instance.
+    """
+    global _sampler
+    if _sampler is None:
+        _sampler = MoistureSampler()
+    return _sampler
+
 
 async def activate_solenoid(solenoid_num: int, time_s: int) -> None:
     """Activate solenoid Pin for a duration given in seconds.
 
+    NOTE: The calling coroutine sleeps for the whole duration, with no
+    coordination between zones. ZoneScheduler (see scheduler module)
+    drives all zones from one Task.
+
     BC Robotics Pico Irrigation board solenoid controller pins 
     are; GPIO2, GPIO3, GPIO4, GPIO5 & GPIO6.
 
@@ -38,12 +62,20 @@ async def activate_solenoid(solenoid_num: int, time_s: int) -> None:
     # solenoid controllers are; GPIO2, GPIO3, GPIO4, GPIO5, GPIO6
     solenoid_gp = Pin(solenoid_num + 1, Pin.OUT)
     solenoid_gp.on()
-    await asyncio.sleep(time_s)
-    solenoid_gp.on()
+    try:
+        await asyncio.sleep(time_s)
+    finally:
+        solenoid_gp.off()
 
 
-async def read_moisture_sensor(sensor_num: int, thing_id: str) -> dict:
-    """Power an Analog sensor and take a reading.
+async def read_moisture_sensor(
+        sensor_num: int,
+        thing_id: str,
+        sampler: MoistureSampler | None = None,
+        calibration: CalibrationTable | None = None
+    ) -> dict:
+    """Power an Analog sensor and take a reading, from a burst of samples
+    read by the MoistureSampler.
 
     BC Robotics Pico Irrigation board Analog sensors are powered 
     using; GP20, GP21 & GP22, which correspond to ADC0 (GP26), 
@@ -53,6 +85,11 @@ async def read_moisture_sensor(sensor_num: int, thing_id: str) -> dict:
 
     Args:
         sensor_num (int): Analog sensor 0 - 2.
+        thing_id (str): AWS IoT 'thing' name.
+        sampler (MoistureSampler, optional): Sampler, or the default
+            sampler (see get_sampler) if None.
+        calibration (CalibrationTable, optional): Sensor calibration, to
+            add the moisture percentage.
 
     Returns:
         A dict containing sensor data: 
@@ -61,58 +98,206 @@ async def read_moisture_sensor(sensor_num: int, thing_id: str) -> dict:
             "thing-id": thing_id,
             "sensor-id": sensor_num,
             "timestamp": timestamp,
-            "reading-u16": Average of 8 u16 readings,
-            "reading-vdc": Average of 8 u16 readings in volts,
+            "reading-u16": Trimmed mean of the u16 burst samples,
+            "reading-vcc": Trimmed mean of the burst samples in volts,
+            "reading-noise": Standard deviation of the trimmed samples,
+            "moisture": Moisture % (with a calibration),
         }
     """
+    if sampler is None:
+        sampler = get_sampler()
 
-    analog_gp = Pin(sensor_num + 20, Pin.OUT)
-    analog_sensor = ADC(Pin(sensor_num + 26, Pin.IN))
+    debug_message("TAKING MOISTURE READINGS", True)
+    await sampler.read(sensor_num)
+    debug_message(
+        f"SENSOR {sensor_num} SETTLED IN {sampler.settle_time[sensor_num]} MS", True
+    )
+    debug_message("RETURNING MOISTURE READINGS", True)
 
-    # power on sensor
-    analog_gp.on()
+    moisture = None
+    if calibration is not None:
+        moisture = calibration.convert(sampler.mean, (sensor_num,))[sensor_num]
+    return format_moisture_reading(
+        sensor_num, thing_id, time.mktime(time.gmtime()),
+        round(sampler.mean[sensor_num]), sampler.noise[sensor_num], moisture
+    )
 
-    N_READINGS = const(2)
 
-    debug_message("TAKING MOISTURE READINGS", True)
+async def scan_moisture_sensors(
+        thing_id: str,
+        sampler: MoistureSampler | None = None,
+        channels: tuple | None = None,
+        calibration: CalibrationTable | None = None
+    ) -> list[dict]:
+    """Scan a set of Analog sensors in one shared settle window, reading
+    their sample bursts round-robin (see MoistureSampler.scan).
 
-    # create array ready for N_READINGS
-    readings = array.array('L', (0 for _ in range(N_READINGS)))
-    for i in range(len(readings)):
-        await asyncio.sleep_ms(250)
-        readings[i] = analog_sensor.read_u16()
+    Args:
+        thing_id (str): AWS IoT 'thing' name.
+        sampler (MoistureSampler, optional): Sampler, or the default
+            sampler (see get_sampler) if None.
+        channels (tuple, optional): Analog sensors 0 - 2 in scan order,
+            or the sampler scan order if None.
+        calibration (CalibrationTable, optional): Sensor calibration, to
+            add the moisture percentage, converted for the whole scan.
+
+    Returns:
+        A list of sensor data dicts (see read_moisture_sensor), in scan
+        order, sharing one timestamp.
+    """
+    if sampler is None:
+        sampler = get_sampler()
+
+    debug_message("SCANNING MOISTURE SENSORS", True)
+    channels = await sampler.scan(channels)
+    timestamp = time.mktime(time.gmtime())
+    moisture = None
+    if calibration is not None:
+        moisture = calibration.convert(sampler.mean, channels)
+    return [
+        format_moisture_reading(
+            n, thing_id, timestamp, round(sampler.mean[n]), sampler.noise[n],
+            None if moisture is None else moisture[n]
+        ) for n in channels
+    ]
 
-    # power off sensor
-    analog_gp.off()
-    conversion_factor = (3.3 / (65535)) * 3
-    reading_avg = round(sum(readings) / N_READINGS)
-   
-    debug_message("RETURNING MOISTURE READINGS", True)
 
-    return {
+def format_moisture_reading(
+        sensor_num: int,
+        thing_id: str,
+        timestamp: int,
+        reading: int,
+        noise: float | None = None,
+        moisture: float | None = None
+    ) -> dict:
+    """Create a moisture sensor reading dict, as published in telemetry.
+
+    Args:
+        sensor_num (int): Analog sensor 0 - 2.
+        thing_id (str): AWS IoT 'thing' name.
+        timestamp (int): Reading timestamp in seconds.
+        reading (int): ADC u16 reading.
+        noise (float, optional): Reading noise estimate in u16 counts,
+            omitted if None.
+        moisture (float, optional): Moisture %, omitted if None or NaN
+            (uncalibrated).
+
+    Returns:
+        A dict containing sensor data (see read_moisture_sensor).
+    """
+    conversion_factor = (3.3 / (65535)) * 3
+    message = {
         "thing-id": thing_id,
         "sensor-id": sensor_num,
-        "timestamp": time.mktime(time.gmtime()),
-        "reading-u16": reading_avg,
-        "reading-vcc": reading_avg * conversion_factor
+        "timestamp": timestamp,
+        "reading-u16": reading,
+        "reading-vcc": reading * conversion_factor
     }
+    if noise is not None:
+        message["reading-noise"] = noise
+    # NaN moisture of an uncalibrated sensor
+    if moisture is not None and moisture == moisture:
+        message["moisture"] = moisture
+    return message
 
 
-def min_max_scale_reading(value: float, min: int, max: int) -> float:
-    """Scale a reading to lie between a given minimum and maximum value.
-    If a moisture sensor reading, along with its calibration min and max 
-    values are passed, the value will be scaled between 0 & 1.
+class ReadingCache:
+    """Latest moisture reading of each sensor, which is reused while it is
+    younger than ttl_ms, rather than powering & sampling the sensor again.
 
-    NOTE: The scaled value * 100 would give the percentage.
+    Readings taken by telemetry scans are put in the cache as well as
+    those taken by get. Concurrent gets for the same sensor share one
+    in-flight measurement.
 
     Args:
-        value (float): Reading value.
-        min (int): Minimum reading value.
-        max (int): Maximum reading value.
-
-    Returns:
-        float: Value scaled between 0 & 1
+        ttl_ms (int, optional): Maximum age of a cached reading.
     """
-    # value will now lie between min & max - i.e. 0 - 1
-    value_scaled = (value - min) / (max - min) 
-    return value_scaled
+
+    def __init__(self, ttl_ms: int = 30_000):
+        self.ttl_ms = ttl_ms
+        self.hits = 0
+        self.misses = 0
+        self._readings = [None] * CHANNELS
+        self._times = [0] * CHANNELS
+        self._pending = [None] * CHANNELS
+
+    def put(self, reading: dict) -> None:
+        """Cache a reading, as the latest reading of its sensor.
+
+        Args:
+            reading (dict): Reading dict (see read_moisture_sensor).
+        """
+        n = reading["sensor-id"]
+        # copied, as batched readings are changed by TelemetryBatch.add
+        self._readings[n] = dict(reading)
+        self._times[n] = time.ticks_ms()
+
+    def invalidate(self, sensor_num: int) -> None:
+        """Remove the cached reading of a sensor.
+
+        Args:
+            sensor_num (int): Analog sensor 0 - 2.
+        """
+        self._readings[sensor_num] = None
+
+    def age(self, sensor_num: int) -> int | None:
+        """Get the age of the cached reading of a sensor.
+
+        Args:
+            sensor_num (int): Analog sensor 0 - 2.
+
+        Returns:
+            Age in milliseconds, or None if there is no cached reading.
+        """
+        if self._readings[sensor_num] is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self._times[sensor_num])
+
+    async def get(
+            self,
+            sensor_num: int,
+            thing_id: str,
+            sampler: MoistureSampler | None = None,
+            calibration: CalibrationTable | None = None
+        ) -> dict:
+        """Get a reading of a sensor, from the cache if it is fresh enough
+        or else by reading the sensor (see read_moisture_sensor).
+
+        Args:
+            sensor_num (int): Analog sensor 0 - 2.
+            thing_id (str): AWS IoT 'thing' name.
+            sampler (MoistureSampler, optional): Sampler, or the default
+                sampler (see get_sampler) if None.
+            calibration (CalibrationTable, optional): Sensor calibration, to
+                add the moisture percentage.
+
+        Returns:
+            A copy of the reading dict, with its "age-ms".
+        """
+        while True:
+            age = self.age(sensor_num)
+            if age is not None and age <= self.ttl_ms:
+                self.hits += 1
+                reading = dict(self._readings[sensor_num])
+                reading["age-ms"] = age
+                return reading
+
+            pending = self._pending[sensor_num]
+            if pending is not None:
+                # share the measurement in flight, then check again
+                await pending.wait()
+                continue
+
+            self.misses += 1
+            pending = self._pending[sensor_num] = asyncio.Event()
+            try:
+                reading = await read_moisture_sensor(
+                    sensor_num, thing_id, sampler, calibration
+                )
+                self.put(reading)
+            finally:
+                self._pending[sensor_num] = None
+                pending.set()
+            reading = dict(reading)
+            reading["age-ms"] = 0
+            return reading
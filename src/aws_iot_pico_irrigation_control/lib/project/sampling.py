@@ -0,0 +1,305 @@
+"""Sampling module contains an oversampling ADC engine for the analog
+moisture sensors on the BC Robotics Pico Irrigation board.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    MoistureSampler: Burst sampling of the analog moisture sensors.
+
+Constants:
+    CHANNELS (int): Number of analog sensor channels.
+"""
+
+import array
+import asyncio
+import math
+import time
+from machine import ADC, Pin
+from micropython import const
+
+CHANNELS = const(3)
+
+# shell sort gaps (Ciura), for bursts of up to 256 samples
+_GAPS = (132, 57, 23, 10, 4, 1)
+
+# samples averaged per adaptive settle poll
+_SETTLE_AVERAGE = const(4)
+
+
+class MoistureSampler:
+    """Oversampling ADC engine, which powers an analog sensor, reads a
+    burst of samples into a preallocated per-channel buffer and reduces
+    them in place.
+
+    The Pin & ADC objects and sample buffers of each channel are created
+    once, so a reading allocates no buffers. A burst is read with
+    spacing_us between samples, after which the buffer is sorted in place
+    and reduced to:
+        median: Median sample (u16).
+        mean: Trimmed mean, excluding trim of the samples at each end.
+        variance: Variance of the trimmed samples.
+        noise: Noise estimate, the standard deviation of the trimmed
+            samples in u16 counts.
+
+    Results are kept in per-channel arrays, indexed by sensor number.
+    A scan powers a set of channels and reads their bursts round-robin
+    into the sample matrix, one row of burst samples per channel, so the
+    readings share one settle window and sampling period. Reads & scans
+    are serialised, as they share the ADC & sample matrix.
+
+    With a settle_tolerance, the sensor output is polled every
+    settle_poll_ms after power-on and the burst is read as soon as
+    settle_count consecutive polls are within settle_tolerance u16 counts
+    of the previous poll, or after settle_ms at the latest. Otherwise the
+    burst is read after a fixed settle_ms. The settle time of the last
+    reading of each channel is kept in settle_time (ms).
+
+    BC Robotics Pico Irrigation board Analog sensors are powered using;
+    GP20, GP21 & GP22, which correspond to ADC0 (GP26), ADC1 (GP27) &
+    ADC2 (GP28) respectively.
+
+    Args:
+        burst (int, optional): Samples per reading, 16 - 256.
+        spacing_us (int, optional): Microseconds between samples.
+        settle_ms (int, optional): Sensor power-on settle time, or the
+            maximum settle time with a settle_tolerance.
+        trim (float, optional): Fraction of samples trimmed at each end
+            for the trimmed mean & variance, 0 - 0.25.
+        settle_tolerance (int, optional): Adaptive settle tolerance in u16
+            counts, or 0 for a fixed settle time.
+        settle_poll_ms (int, optional): Adaptive settle poll interval.
+        settle_count (int, optional): Consecutive polls within tolerance
+            for the output to be settled.
+        scan_order (tuple, optional): Default scan channels, in the order
+            they are powered & read.
+        stagger_ms (int, optional): Delay between powering scan channels.
+    """
+
+    def __init__(
+            self,
+            burst: int = 64,
+            spacing_us: int = 200,
+            settle_ms: int = 250,
+            trim: float = 0.125,
+            settle_tolerance: int = 0,
+            settle_poll_ms: int = 10,
+            settle_count: int = 3,
+            scan_order: tuple = (0, 1, 2),
+            stagger_ms: int = 0
+        ):
+        assert 16 <= burst <= 256
+        assert 0 <= trim <= 0.25
+        self.burst = burst
+        self.spacing_us = spacing_us
+        self.settle_ms = settle_ms
+        self.trim = int(burst * trim)
+        self.settle_tolerance = settle_tolerance
+        self.settle_poll_ms = settle_poll_ms
+        self.settle_count = settle_count
+        self.scan_order = scan_order
+        self.stagger_ms = stagger_ms
+        self._lock = asyncio.Lock()
+        self._power = [Pin(n + 20, Pin.OUT) for n in range(CHANNELS)]
+        self._adc = [ADC(Pin(n + 26, Pin.IN)) for n in range(CHANNELS)]
+        # sample matrix, a row of burst samples per channel
+        self._matrix = array.array("H", bytes(2 * burst * CHANNELS))
+        matrix = memoryview(self._matrix)
+        self._samples = [matrix[n * burst : (n + 1) * burst] for n in range(CHANNELS)]
+        self._last = array.array("H", bytes(2 * CHANNELS))
+        self._stable = bytearray(CHANNELS)
+        self.median = array.array("H", bytes(2 * CHANNELS))
+        self.mean = array.array("f", bytes(4 * CHANNELS))
+        self.variance = array.array("f", bytes(4 * CHANNELS))
+        self.noise = array.array("f", bytes(4 * CHANNELS))
+        self.settle_time = array.array("H", bytes(2 * CHANNELS))
+
+    async def read(self, channel: int) -> int:
+        """Power a sensor, read a burst of samples & reduce them.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+
+        Returns:
+            Median u16 reading of the burst.
+        """
+        async with self._lock:
+            power = self._power[channel]
+            power.on()
+            try:
+                await self.settle(channel)
+                self.read_burst(channel)
+            finally:
+                power.off()
+            self.reduce(channel)
+        return self.median[channel]
+
+    async def scan(self, channels: tuple | None = None) -> tuple:
+        """Power a set of sensors, wait one shared settle window & read
+        their bursts round-robin into the sample matrix, then reduce them.
+
+        Sensors are powered in scan order, stagger_ms apart, to limit the
+        inrush current.
+
+        Args:
+            channels (tuple, optional): Analog sensors 0 - 2 in scan order,
+                or scan_order if None.
+
+        Returns:
+            The scanned channels, in scan order.
+        """
+        if channels is None:
+            channels = self.scan_order
+        async with self._lock:
+            try:
+                for i, channel in enumerate(channels):
+                    if i and self.stagger_ms:
+                        await asyncio.sleep_ms(self.stagger_ms)
+                    self._power[channel].on()
+                await self.settle(*channels)
+                self.read_round_robin(channels)
+            finally:
+                for channel in channels:
+                    self._power[channel].off()
+            for channel in channels:
+                self.reduce(channel)
+        return channels
+
+    async def settle(self, *channels: int) -> int:
+        """Wait for powered sensor outputs to settle, for a fixed
+        settle_ms or adaptively with a settle_tolerance (see class). The
+        adaptive wait ends when every channel has settled.
+
+        Args:
+            *channels (int): Analog sensors 0 - 2.
+
+        Returns:
+            Settle time in milliseconds.
+        """
+        settle_time = self.settle_time
+        if not self.settle_tolerance:
+            await asyncio.sleep_ms(self.settle_ms)
+            for channel in channels:
+                settle_time[channel] = self.settle_ms
+            return self.settle_ms
+
+        last, stable, count = self._last, self._stable, self.settle_count
+        start = time.ticks_ms()
+        for channel in channels:
+            last[channel] = self._poll(self._adc[channel].read_u16)
+            stable[channel] = 0
+        pending = len(channels)
+        while True:
+            await asyncio.sleep_ms(self.settle_poll_ms)
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
+            for channel in channels:
+                if stable[channel] >= count:
+                    continue
+                value = self._poll(self._adc[channel].read_u16)
+                if abs(value - last[channel]) <= self.settle_tolerance:
+                    stable[channel] += 1
+                else:
+                    stable[channel] = 0
+                last[channel] = value
+                if stable[channel] >= count:
+                    settle_time[channel] = min(elapsed, 0xFFFF)
+                    pending -= 1
+            if not pending or elapsed >= self.settle_ms:
+                break
+        # channels which timed out
+        for channel in channels:
+            if stable[channel] < count:
+                settle_time[channel] = min(elapsed, 0xFFFF)
+        return elapsed
+
+    @staticmethod
+    def _poll(read_u16) -> int:
+        """Average a few samples, for an adaptive settle poll."""
+        total = 0
+        for _ in range(_SETTLE_AVERAGE):
+            total += read_u16()
+        return total // _SETTLE_AVERAGE
+
+    def read_burst(self, channel: int) -> None:
+        """Read a burst of samples into the channel buffer. The burst is
+        read without yielding, so samples are evenly spaced.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+        """
+        read_u16 = self._adc[channel].read_u16
+        samples = self._samples[channel]
+        spacing_us = self.spacing_us
+        for i in range(len(samples)):
+            samples[i] = read_u16()
+            time.sleep_us(spacing_us)
+
+    def read_round_robin(self, channels: tuple) -> None:
+        """Read a burst of samples of each channel into the sample matrix,
+        one sample of each channel in turn, spacing_us between rounds.
+
+        Args:
+            channels (tuple): Analog sensors 0 - 2 in scan order.
+        """
+        reads = [(self._adc[channel].read_u16, self._samples[channel])
+                 for channel in channels]
+        spacing_us = self.spacing_us
+        for i in range(self.burst):
+            for read_u16, samples in reads:
+                samples[i] = read_u16()
+            time.sleep_us(spacing_us)
+
+    def reduce(self, channel: int) -> None:
+        """Sort the channel buffer in place and compute its median,
+        trimmed mean, variance & noise estimate.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+        """
+        samples = self._samples[channel]
+        n = len(samples)
+        self._sort(samples)
+        self.median[channel] = (samples[(n - 1) // 2] + samples[n // 2]) // 2
+
+        start, end = self.trim, n - self.trim
+        total = 0
+        for i in range(start, end):
+            total += samples[i]
+        mean = total / (end - start)
+        squares = 0.0
+        for i in range(start, end):
+            d = samples[i] - mean
+            squares += d * d
+        variance = squares / (end - start)
+        self.mean[channel] = mean
+        self.variance[channel] = variance
+        self.noise[channel] = math.sqrt(variance)
+
+    @staticmethod
+    def _sort(samples: array.array) -> None:
+        """Shell sort an array in place."""
+        n = len(samples)
+        for gap in _GAPS:
+            for i in range(gap, n):
+                x = samples[i]
+                j = i
+                while j >= gap and samples[j - gap] > x:
+                    samples[j] = samples[j - gap]
+                    j -= gap
+                samples[j] = x
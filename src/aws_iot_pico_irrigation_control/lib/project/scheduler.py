@@ -0,0 +1,244 @@
+"""Scheduler module contains an irrigation zone scheduler, which drives
+the solenoid valves of the BC Robotics Pico Irrigation board from a
+single asyncio Task.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    ZoneScheduler: Irrigation zone valve scheduler.
+
+Constants:
+    ZONES (int): Number of irrigation zones (solenoid valves).
+"""
+
+import asyncio
+import heapq
+import time
+from machine import Pin
+from micropython import const
+
+ZONES = const(5)
+
+
+class ZoneScheduler:
+    """Irrigation zone scheduler, which opens zone valves for a duration
+    with at most max_open zones open at once, for the 12 V supply & water
+    pressure limits. Zones started while max_open zones are open are
+    queued, in request order, and opened as other zones close.
+
+    Valve-off deadlines of open zones are kept in a min-heap, so the run
+    Task sleeps until the earliest deadline, or until woken by a change of
+    schedule. Extended & cancelled zones leave their old heap entries in
+    place, which are skipped once popped, as their deadline no longer
+    matches the zone.
+
+    Deadlines are kept on a millisecond clock accumulated from
+    time.ticks_diff, so they do not wrap with time.ticks_ms.
+
+    BC Robotics Pico Irrigation board solenoid controller pins are; GPIO2,
+    GPIO3, GPIO4, GPIO5 & GPIO6, for zones 1 - 5.
+
+    https://bc-robotics.com/datasheets/raspberry-pi-pico-irrigation-board-schematic.pdf
+
+    Args:
+        max_open (int, optional): Maximum number of zones open at once.
+    """
+
+    def __init__(self, max_open: int = 1):
+        assert 0 < max_open <= ZONES
+        self.max_open = max_open
+        self._valves = [
+            Pin(zone + 1, Pin.OUT, value=0) for zone in range(1, ZONES + 1)
+        ]
+        # zone id -> valve-off deadline of open zones
+        self._open = {}
+        # (deadline, zone id) of open zones
+        self._heap = []
+        # (zone id, duration ms) of queued zones
+        self._queue = []
+        self._wake = asyncio.Event()
+        self._ticks = time.ticks_ms()
+        self._clock = 0
+
+    def _now(self) -> int:
+        """Get the scheduler clock in milliseconds."""
+        ticks = time.ticks_ms()
+        self._clock += time.ticks_diff(ticks, self._ticks)
+        self._ticks = ticks
+        return self._clock
+
+    def _check_zone(self, zone: int) -> None:
+        if not 1 <= zone <= ZONES:
+            raise ValueError(f"Invalid zone {zone}")
+
+    def _valve(self, zone: int, state: bool) -> None:
+        self._valves[zone - 1].value(state)
+
+    def _open_zone(self, zone: int, duration_ms: int) -> None:
+        deadline = self._now() + duration_ms
+        self._open[zone] = deadline
+        heapq.heappush(self._heap, (deadline, zone))
+        self._valve(zone, True)
+
+    def _close_zone(self, zone: int) -> None:
+        self._valve(zone, False)
+        del self._open[zone]
+
+    def _fill(self) -> None:
+        """Open queued zones, while fewer than max_open zones are open."""
+        while self._queue and len(self._open) < self.max_open:
+            zone, duration_ms = self._queue.pop(0)
+            self._open_zone(zone, duration_ms)
+
+    def start(self, zone: int, duration_s: int) -> bool:
+        """Open a zone for a duration, or queue it if max_open zones are
+        open. An open zone is restarted with the new duration, and a queued
+        zone keeps its place with the new duration.
+
+        Args:
+            zone (int): Zone 1 - 5.
+            duration_s (int): Duration in seconds.
+
+        Raises:
+            ValueError: If the zone is invalid.
+
+        Returns:
+            True if the zone is open, False if it is queued.
+        """
+        self._check_zone(zone)
+        duration_ms = int(duration_s * 1000)
+        if zone in self._open:
+            self._open[zone] = deadline = self._now() + duration_ms
+            heapq.heappush(self._heap, (deadline, zone))
+        else:
+            for i, (queued, _) in enumerate(self._queue):
+                if queued == zone:
+                    self._queue[i] = (zone, duration_ms)
+                    return False
+            if len(self._open) >= self.max_open:
+                self._queue.append((zone, duration_ms))
+                return False
+            self._open_zone(zone, duration_ms)
+        self._wake.set()
+        return True
+
+    def extend(self, zone: int, duration_s: int) -> bool:
+        """Extend the duration of an open or queued zone.
+
+        Args:
+            zone (int): Zone 1 - 5.
+            duration_s (int): Additional duration in seconds.
+
+        Raises:
+            ValueError: If the zone is invalid.
+
+        Returns:
+            True if the zone was open or queued.
+        """
+        self._check_zone(zone)
+        duration_ms = int(duration_s * 1000)
+        if zone in self._open:
+            self._open[zone] = deadline = self._open[zone] + duration_ms
+            heapq.heappush(self._heap, (deadline, zone))
+            return True
+        for i, (queued, queued_ms) in enumerate(self._queue):
+            if queued == zone:
+                self._queue[i] = (zone, queued_ms + duration_ms)
+                return True
+        return False
+
+    def cancel(self, zone: int) -> bool:
+        """Close an open zone, or remove a queued zone.
+
+        Args:
+            zone (int): Zone 1 - 5.
+
+        Raises:
+            ValueError: If the zone is invalid.
+
+        Returns:
+            True if the zone was open or queued.
+        """
+        self._check_zone(zone)
+        if zone in self._open:
+            self._close_zone(zone)
+            self._fill()
+            self._wake.set()
+            return True
+        for i, (queued, _) in enumerate(self._queue):
+            if queued == zone:
+                del self._queue[i]
+                return True
+        return False
+
+    def cancel_all(self) -> None:
+        """Close all zones and clear the queue."""
+        self._queue.clear()
+        for zone in list(self._open):
+            self._close_zone(zone)
+        self._heap.clear()
+        self._wake.set()
+
+    def status(self) -> dict:
+        """Get the open & queued zones, for command responses.
+
+        Returns:
+            A dict of the "open" zones, as {"zone-id", "remaining"} dicts
+            with the remaining duration in seconds, & "queued" zones, as
+            {"zone-id", "duration"} dicts.
+        """
+        now = self._now()
+        return {
+            "open": [
+                {"zone-id": zone, "remaining": max(deadline - now, 0) / 1000}
+                for zone, deadline in self._open.items()
+            ],
+            "queued": [
+                {"zone-id": zone, "duration": duration_ms / 1000}
+                for zone, duration_ms in self._queue
+            ],
+        }
+
+    async def run(self) -> None:
+        """Close zones at their deadline and open queued zones. This Task
+        drives all zone valves, and closes them when cancelled."""
+        heap = self._heap
+        try:
+            while True:
+                now = self._now()
+                while heap and heap[0][0] <= now:
+                    deadline, zone = heapq.heappop(heap)
+                    # skip the entries of extended or cancelled zones
+                    if self._open.get(zone) == deadline:
+                        self._close_zone(zone)
+                self._fill()
+
+                self._wake.clear()
+                if heap:
+                    try:
+                        await asyncio.wait_for_ms(
+                            self._wake.wait(), max(heap[0][0] - self._now(), 1)
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._wake.wait()
+        finally:
+            self.cancel_all()
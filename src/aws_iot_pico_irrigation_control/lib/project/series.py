@@ -0,0 +1,250 @@
+"""Series module contains an in-RAM time series of moisture sensor
+readings, with rolling window aggregates.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    ReadingSeries: Ring buffer of readings per sensor channel.
+"""
+
+import array
+import math
+from .sampling import CHANNELS
+
+
+class _Window:
+    """Rolling aggregates of the last size readings of a channel.
+
+    Mean & variance are updated with Welford's method, adding the new
+    reading and removing the reading leaving the window. Single precision
+    rounding is reset by recomputing them from the ring every size
+    readings. Min & max are the fronts of monotonic queues of (sequence
+    number, reading), which are amortised O(1) per reading.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        # min & max queue rings, of sequence numbers & readings
+        self._seq = [array.array("I", bytes(4 * size)) for _ in range(2)]
+        self._value = [array.array("H", bytes(2 * size)) for _ in range(2)]
+        self._head = [0, 0]
+        self._length = [0, 0]
+
+    def push(self, seq: int, x: int, removed: int | None) -> None:
+        """Add reading x (sequence number seq) to the window, removing the
+        reading leaving it, if it is full."""
+        if removed is None:
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+        else:
+            mean = self.mean
+            self.mean += (x - removed) / self.size
+            self.m2 += (x - removed) * (x - self.mean + removed - mean)
+            if self.m2 < 0:
+                self.m2 = 0.0
+        self._queue(0, seq, x, True)
+        self._queue(1, seq, x, False)
+
+    def _queue(self, q: int, seq: int, x: int, is_min: bool) -> None:
+        seqs, values, size = self._seq[q], self._value[q], self.size
+        head, length = self._head[q], self._length[q]
+        # drop the front reading once it leaves the window
+        if length and seqs[head] + size <= seq:
+            head = (head + 1) % size
+            length -= 1
+        # drop readings which can no longer be the min (max)
+        while length:
+            back = values[(head + length - 1) % size]
+            if (back < x) if is_min else (back > x):
+                break
+            length -= 1
+        seqs[(head + length) % size] = seq
+        values[(head + length) % size] = x
+        self._head[q], self._length[q] = head, length + 1
+
+    def reset(self, mean: float, m2: float) -> None:
+        self.mean, self.m2 = mean, m2
+
+    def min(self) -> int:
+        return self._value[0][self._head[0]]
+
+    def max(self) -> int:
+        return self._value[1][self._head[1]]
+
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class ReadingSeries:
+    """Fixed-capacity ring buffer of timestamped raw readings per sensor
+    channel, held in preallocated arrays, with O(1) rolling min, max, mean
+    & standard deviation over windows of the last n readings.
+
+    Readings are appended per channel, overwriting the oldest once the
+    ring holds capacity readings. Windows can be at most capacity
+    readings, so the reading leaving a window is always still in the ring.
+
+    Args:
+        capacity (int, optional): Readings held per channel.
+        windows (tuple, optional): Window sizes, in readings.
+    """
+
+    def __init__(self, capacity: int = 240, windows: tuple = (12, 60)):
+        assert all(0 < size <= capacity for size in windows)
+        self.capacity = capacity
+        self.windows = windows
+        self.timestamps = array.array("I", bytes(4 * CHANNELS * capacity))
+        self.values = array.array("H", bytes(2 * CHANNELS * capacity))
+        # readings appended per channel, the sequence number of the next
+        self.seq = array.array("I", bytes(4 * CHANNELS))
+        self._windows = [
+            [_Window(size) for size in windows] for _ in range(CHANNELS)
+        ]
+
+    def __len__(self) -> int:
+        return sum(min(n, self.capacity) for n in self.seq)
+
+    def count(self, channel: int) -> int:
+        """Get the number of readings held for a channel.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+        """
+        return min(self.seq[channel], self.capacity)
+
+    def append(self, channel: int, timestamp: int, reading: int) -> None:
+        """Append a reading to a channel, updating its windows.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+            timestamp (int): Reading timestamp in seconds.
+            reading (int): ADC u16 reading.
+        """
+        seq = self.seq[channel]
+        base = channel * self.capacity
+        values = self.values
+        for window in self._windows[channel]:
+            size = window.size
+            removed = None
+            if seq >= size:
+                removed = values[base + (seq - size) % self.capacity]
+            window.push(seq, reading, removed)
+        i = base + seq % self.capacity
+        self.timestamps[i] = timestamp
+        values[i] = reading
+        self.seq[channel] = seq + 1
+        for window in self._windows[channel]:
+            if seq >= window.size and (seq + 1) % window.size == 0:
+                self._resync(channel, window)
+
+    def _resync(self, channel: int, window: _Window) -> None:
+        """Recompute the mean & variance of a full window from the ring."""
+        values, capacity = self.values, self.capacity
+        base = channel * capacity
+        end = self.seq[channel]
+        total = 0
+        for seq in range(end - window.size, end):
+            total += values[base + seq % capacity]
+        mean = total / window.size
+        m2 = 0.0
+        for seq in range(end - window.size, end):
+            d = values[base + seq % capacity] - mean
+            m2 += d * d
+        window.reset(mean, m2)
+
+    def summary(self, channel: int, window: int) -> dict | None:
+        """Get the aggregates of a channel window.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+            window (int): Window index, into windows.
+
+        Returns:
+            A dict of the window aggregates, or None if the channel has no
+            readings:
+
+            {
+                "sensor-id": channel,
+                "timestamp": Timestamp of the latest reading,
+                "window": Window size,
+                "count": Readings in the window,
+                "min": Minimum reading u16,
+                "max": Maximum reading u16,
+                "mean": Mean reading u16,
+                "stddev": Standard deviation of the readings,
+            }
+        """
+        seq = self.seq[channel]
+        if not seq:
+            return None
+        w = self._windows[channel][window]
+        return {
+            "sensor-id": channel,
+            "timestamp": self.timestamps[
+                channel * self.capacity + (seq - 1) % self.capacity
+            ],
+            "window": w.size,
+            "count": w.count,
+            "min": w.min(),
+            "max": w.max(),
+            "mean": w.mean,
+            "stddev": w.stddev(),
+        }
+
+    def summaries(self, channels: tuple = (0, 1, 2)) -> list[dict]:
+        """Get the aggregates of every window of a set of channels.
+
+        Args:
+            channels (tuple, optional): Analog sensors 0 - 2.
+
+        Returns:
+            List of window summary dicts (see summary).
+        """
+        summaries = []
+        for channel in channels:
+            for window in range(len(self.windows)):
+                summary = self.summary(channel, window)
+                if summary is not None:
+                    summaries.append(summary)
+        return summaries
+
+    def history(self, channel: int, n: int) -> list[list[int]]:
+        """Get the latest readings of a channel, without reading the ADC.
+
+        Args:
+            channel (int): Analog sensor 0 - 2.
+            n (int): Maximum number of readings.
+
+        Returns:
+            List of [timestamp, reading u16] pairs, oldest first.
+        """
+        end = self.seq[channel]
+        start = end - min(n, self.count(channel))
+        base = channel * self.capacity
+        return [
+            [self.timestamps[base + seq % self.capacity],
+             self.values[base + seq % self.capacity]]
+            for seq in range(start, end)
+        ]
@@ -0,0 +1,189 @@
+"""Store module contains a flash-backed ring buffer, which holds moisture
+sensor readings taken while the device is offline, so they can be
+forwarded once the MQTT connection is restored.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    TelemetryStore: Fixed-size record ring buffer file.
+
+Constants:
+    RECORD_SIZE (int): Size of a stored reading in bytes.
+"""
+
+import struct
+from micropython import const
+
+# magic, version, record size, capacity, head, count
+_HEADER = "<2sBBHHH"
+_HEADER_SIZE = const(10)
+_MAGIC = b"TQ"
+_VERSION = const(1)
+
+# timestamp, sensor id, padding, reading u16
+_RECORD = "<IBxH"
+RECORD_SIZE = const(8)
+
+
+class TelemetryStore:
+    """Bounded ring buffer of fixed-size sensor reading records, stored
+    in a file on the Pico filesystem.
+
+    The file holds a 10 byte header followed by capacity record slots,
+    allocated when the file is created. Readings are appended after the
+    newest record and the oldest record is overwritten once the buffer is
+    full. Records are read in contiguous batches into a caller supplied
+    buffer and only removed by consume, after they have been forwarded.
+
+    Appended records are written without the header, which is written by
+    flush (once per sampling cycle) and consume, to limit flash writes.
+    Records appended before a reset without a flush are lost.
+
+    Record layout (8 bytes, little endian):
+        timestamp (u32), sensor id (u8), padding (u8), reading u16 (u16)
+
+    Args:
+        path (str, optional): Ring buffer file path.
+        capacity (int, optional): Maximum number of stored records.
+    """
+
+    def __init__(self, path: str = "telemetry.bin", capacity: int = 1024):
+        assert 0 < capacity < 65536
+        self.path = path
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        # records read by read_records & since overwritten by append
+        self._overwritten = 0
+        self._header = bytearray(_HEADER_SIZE)
+        self._record = bytearray(RECORD_SIZE)
+        self._file = self._open()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _open(self):
+        """Open the ring buffer file, creating it if it is missing or was
+        written with a different layout or capacity."""
+        try:
+            f = open(self.path, "r+b")
+            if f.readinto(self._header) == _HEADER_SIZE:
+                magic, version, size, capacity, head, count = struct.unpack(
+                    _HEADER, self._header
+                )
+                if (
+                    magic == _MAGIC and version == _VERSION
+                    and size == RECORD_SIZE and capacity == self.capacity
+                ):
+                    self.head, self.count = head, count
+                    return f
+            f.close()
+        except OSError:
+            pass
+
+        f = open(self.path, "w+b")
+        self._write_header(f)
+        for _ in range(self.capacity):
+            f.write(self._record)
+        f.flush()
+        return f
+
+    def _write_header(self, f) -> None:
+        struct.pack_into(
+            _HEADER, self._header, 0, _MAGIC, _VERSION,
+            RECORD_SIZE, self.capacity, self.head, self.count
+        )
+        f.seek(0)
+        f.write(self._header)
+
+    def _seek_record(self, index: int) -> None:
+        self._file.seek(_HEADER_SIZE + (index % self.capacity) * RECORD_SIZE)
+
+    def append(self, timestamp: int, sensor_id: int, reading: int) -> None:
+        """Append a reading, overwriting the oldest record if full. The
+        header is not written until flush.
+
+        Args:
+            timestamp (int): Reading timestamp in seconds.
+            sensor_id (int): Analog sensor 0 - 2.
+            reading (int): ADC u16 reading.
+        """
+        struct.pack_into(_RECORD, self._record, 0, timestamp, sensor_id, reading)
+        self._seek_record(self.head + self.count)
+        self._file.write(self._record)
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self._overwritten += 1
+        else:
+            self.count += 1
+
+    def flush(self) -> None:
+        """Write the header and flush appended records to the file."""
+        self._write_header(self._file)
+        self._file.flush()
+
+    def read_records(self, buffer: bytearray) -> int:
+        """Read the oldest records into buffer, without removing them.
+
+        Args:
+            buffer (bytearray): Buffer sized as a multiple of RECORD_SIZE.
+
+        Returns:
+            Number of records read into buffer.
+        """
+        n = min(len(buffer) // RECORD_SIZE, self.count)
+        self._overwritten = 0
+        # records up to the end of the file, then any wrapped remainder
+        first = min(n, self.capacity - self.head)
+        mv = memoryview(buffer)
+        self._seek_record(self.head)
+        self._file.readinto(mv[: first * RECORD_SIZE])
+        if n > first:
+            self._seek_record(0)
+            self._file.readinto(mv[first * RECORD_SIZE : n * RECORD_SIZE])
+        return n
+
+    def consume(self, n: int) -> None:
+        """Remove the n oldest records, once they have been forwarded.
+        Records of the last read_records batch which were overwritten by
+        append since are not counted again.
+
+        Args:
+            n (int): Number of records to remove.
+        """
+        n = min(max(n - self._overwritten, 0), self.count)
+        self._overwritten = 0
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+        self._write_header(self._file)
+        self._file.flush()
+
+    @staticmethod
+    def unpack(buffer: bytearray, index: int) -> tuple[int, int, int]:
+        """Unpack a record from a buffer filled by read_records.
+
+        Args:
+            buffer (bytearray): Record buffer.
+            index (int): Record index within buffer.
+
+        Returns:
+            A (timestamp, sensor id, reading u16) tuple.
+        """
+        return struct.unpack_from(_RECORD, buffer, index * RECORD_SIZE)
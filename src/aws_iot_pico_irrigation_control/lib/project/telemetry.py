@@ -20,24 +20,437 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+Classes:
+    ReportPolicy: Deadband & heartbeat reporting of sensor readings.
+    TelemetryBatch: Collects sampling cycles into one MQTT message.
+
 Functions:
+    read_health: Read system health values.
     read_internal_temperature: Read internal RP2040 temperature.
     read_vsys: Measure vsys voltage.
+
+Constants:
+    SCHEMA_VERSION (int): Batched telemetry message schema version.
 """
 
-from machine import ADC, Pin
+import array
+import io
+import struct
+import time
+from machine import ADC, Pin, disable_irq, enable_irq
+from micropython import const
+from .encoder import JSONPayload
+from .sampling import CHANNELS
+
+try:
+    import deflate
+except ImportError:
+    # firmware without the deflate module, messages are not compressed
+    deflate = None
+
+SCHEMA_VERSION = const(5)
+
+# header flags (content encoding): body after the header is raw deflate
+# compressed, body is JSON rather than health values & readings
+_FLAG_DEFLATE = const(0x01)
+_FLAG_JSON = const(0x02)
+# deflate window size (2 ** 10 bytes)
+_DEFLATE_WBITS = const(10)
+
+# binary encoding: header (schema version, flags, thing id length,
+# reading count, health count, summary count), then health values,
+# readings & window summaries
+_BIN_HEADER = "<BBBHHH"
+_BIN_HEADER_SIZE = const(9)
+# timestamp, vsys (mV), temperature (centi-degrees Celsius)
+_BIN_HEALTH = "<IHh"
+_BIN_HEALTH_SIZE = const(8)
+# sensor id, timestamp, reading u16, noise (0.1 u16 counts),
+# moisture (0.01 %)
+_BIN_READING = "<BIHHH"
+_BIN_READING_SIZE = const(11)
+# noise & moisture of readings without a noise estimate or calibration
+_BIN_NO_NOISE = const(0xFFFF)
+_BIN_NO_MOISTURE = const(0xFFFF)
+# sensor id, timestamp, window, count, min u16, max u16, mean, stddev
+_BIN_SUMMARY = "<BIHHHHff"
+_BIN_SUMMARY_SIZE = const(21)
+
+
+class ReportPolicy:
+    """Change-triggered reporting of sensor readings, per sensor channel.
+
+    A reading is reported if it is the first of its channel, if it moved
+    more than the channel deadband (u16 counts) from the last reported
+    reading, or as a heartbeat once heartbeat_s seconds have passed since
+    the last reported reading. Other readings are skipped.
+
+    Args:
+        deadband (int | tuple, optional): Deadband in u16 counts, for all
+            channels or per channel.
+        heartbeat_s (int, optional): Maximum interval between reported
+            readings of a channel, in seconds.
+    """
+
+    def __init__(self, deadband: int | tuple = 512, heartbeat_s: int = 3600):
+        if isinstance(deadband, int):
+            deadband = (deadband,) * CHANNELS
+        self.deadband = deadband
+        self.heartbeat_s = heartbeat_s
+        self.last = array.array("H", bytes(2 * CHANNELS))
+        self.last_time = array.array("I", bytes(4 * CHANNELS))
+        self.reported = bytearray(CHANNELS)
+        self.changed = False
+        self.skipped = 0
+
+    def due(self, reading: dict) -> int:
+        """Check whether a reading should be reported.
+
+        Args:
+            reading (dict): Reading dict (see read_moisture_sensor).
+
+        Returns:
+            0 if not due, 1 for a heartbeat, 2 for a change.
+        """
+        n = reading["sensor-id"]
+        if not self.reported[n]:
+            return 2
+        if abs(reading["reading-u16"] - self.last[n]) > self.deadband[n]:
+            return 2
+        if reading["timestamp"] - self.last_time[n] >= self.heartbeat_s:
+            return 1
+        return 0
+
+    def select(self, readings: list[dict]) -> list[dict]:
+        """Select the readings to report, recording them as the last
+        reported reading of their channel. changed is set if any reading
+        was selected for a change, rather than a heartbeat.
+
+        Args:
+            readings (list): Reading dicts (see read_moisture_sensor).
+
+        Returns:
+            List of readings to report.
+        """
+        selected = []
+        self.changed = False
+        for reading in readings:
+            due = self.due(reading)
+            if not due:
+                self.skipped += 1
+                continue
+            n = reading["sensor-id"]
+            self.last[n] = reading["reading-u16"]
+            self.last_time[n] = reading["timestamp"]
+            self.reported[n] = 1
+            self.changed = self.changed or due == 2
+            selected.append(reading)
+        return selected
+
+
+class TelemetryBatch:
+    """Collects the sensor readings, and optionally system health values,
+    of one or more sampling cycles into a single telemetry message.
+
+    A batch is ready to publish once it holds size cycles, or once
+    interval_ms has elapsed since its first cycle (if interval_ms > 0).
+
+    Message schema (version 4):
+        {
+            "schema-version": 4,
+            "thing-id": str,
+            "readings": [
+                {
+                    "sensor-id": int,
+                    "timestamp": int,
+                    "reading-u16": int,
+                    "reading-vcc": float,
+                    "reading-noise": float,
+                    "moisture": float
+                },
+                ...
+            ],
+            "health": [
+                {"timestamp": int, "vsys": float, "temperature": float},
+                ...
+            ],
+            "summaries": [
+                {
+                    "sensor-id": int,
+                    "timestamp": int,
+                    "window": int,
+                    "count": int,
+                    "min": int,
+                    "max": int,
+                    "mean": float,
+                    "stddev": float
+                },
+                ...
+            ]
+        }
+
+    The "health" & "summaries" lists are omitted if no health values or
+    window summaries (see ReadingSeries.summary) were added, as is
+    "reading-noise" & "moisture" for readings replayed from the telemetry
+    store, and "moisture" for uncalibrated sensors. Each
+    entry in "readings" is one row for Firehose/S3 consumers, with the
+    "thing-id" taken from the message.
+
+    With binary set, the message is struct packed instead (little endian),
+    which is decoded by tools/telemetry_decoder.py:
+        header (9 bytes):
+            schema version (u8), flags (u8), thing id length (u8),
+            reading count (u16), health count (u16), summary count (u16)
+        thing id (utf-8)
+        health (8 bytes each):
+            timestamp (u32), vsys mV (u16), temperature centi-°C (i16)
+        readings (11 bytes each):
+            sensor id (u8), timestamp (u32), reading u16 (u16),
+            noise in 0.1 u16 counts (u16, 0xFFFF if omitted),
+            moisture in 0.01 % (u16, 0xFFFF if omitted)
+        summaries (21 bytes each):
+            sensor id (u8), timestamp (u32), window (u16), count (u16),
+            min u16 (u16), max u16 (u16), mean (f32), stddev (f32)
+
+    "reading-vcc" is not sent in the binary encoding, as it is derived
+    from "reading-u16".
+
+    Messages of at least compress_min bytes are deflate compressed, if
+    the deflate module is available. A compressed message starts with the
+    binary header, with the deflate flag (0x01) set and, for JSON, the JSON
+    flag (0x02). The rest of the message is a raw deflate stream of the
+    message body (binary) or the whole JSON message.
+
+    Args:
+        thing_id (str): AWS IoT 'thing' name.
+        size (int, optional): Sampling cycles per message.
+        interval_ms (int, optional): Maximum batch age in milliseconds.
+        binary (bool, optional): Use the binary message encoding.
+        compress_min (int, optional): Minimum message size in bytes to
+            compress, or 0 to never compress.
+    """
+
+    def __init__(
+            self,
+            thing_id: str,
+            size: int = 1,
+            interval_ms: int = 0,
+            binary: bool = False,
+            compress_min: int = 0
+        ):
+        self.thing_id = thing_id
+        self.size = size
+        self.interval_ms = interval_ms
+        self.binary = binary
+        self.compress_min = compress_min if deflate is not None else 0
+        self.readings = []
+        self.health = []
+        self.summaries = []
+        self.cycles = 0
+        self.started = 0
+        self._thing_id = thing_id.encode()
+        self._buffer = bytearray(0)
+        self._payload = JSONPayload()
+
+    def __len__(self) -> int:
+        return len(self.readings)
+
+    def add(
+            self,
+            readings: list[dict],
+            health: dict | None = None,
+            summaries: list[dict] | None = None
+        ) -> None:
+        """Add the readings of a sampling cycle to the batch.
+
+        Args:
+            readings (list): Reading dicts (see read_moisture_sensor).
+            health (dict, optional): System health values (see read_health).
+            summaries (list, optional): Window summary dicts (see
+                ReadingSeries.summary).
+        """
+        if not self.cycles:
+            self.started = time.ticks_ms()
+        for reading in readings:
+            reading.pop("thing-id", None)
+            self.readings.append(reading)
+        if health is not None:
+            self.health.append(health)
+        if summaries:
+            self.summaries.extend(summaries)
+        self.cycles += 1
+
+    def ready(self) -> bool:
+        """Check whether the batch should be published.
+
+        Returns:
+            True if the batch size or flush interval has been reached.
+        """
+        if not self.cycles:
+            return False
+        if self.cycles >= self.size:
+            return True
+        elapsed = time.ticks_diff(time.ticks_ms(), self.started)
+        return self.interval_ms > 0 and elapsed >= self.interval_ms
+
+    def message(self) -> dict:
+        """Get the batched telemetry message.
+
+        Returns:
+            Batched telemetry message dict.
+        """
+        message = {
+            "schema-version": SCHEMA_VERSION,
+            "thing-id": self.thing_id,
+            "readings": self.readings,
+        }
+        if self.health:
+            message["health"] = self.health
+        if self.summaries:
+            message["summaries"] = self.summaries
+        return message
+
+    def encode(self) -> memoryview:
+        """Get the batched telemetry message in the binary encoding.
+
+        NOTE: The message is packed into a buffer reused by the next call,
+        so a QoS 1 message must be acknowledged before the next encode, or
+        the buffer released (see release).
+
+        Returns:
+            View of the encoded message.
+        """
+        thing_id = self._thing_id
+        size = (
+            _BIN_HEADER_SIZE + len(thing_id)
+            + len(self.health) * _BIN_HEALTH_SIZE
+            + len(self.readings) * _BIN_READING_SIZE
+            + len(self.summaries) * _BIN_SUMMARY_SIZE
+        )
+        if len(self._buffer) < size:
+            self._buffer = bytearray(size)
+        buffer = self._buffer
+        struct.pack_into(
+            _BIN_HEADER, buffer, 0, SCHEMA_VERSION, 0, len(thing_id),
+            len(self.readings), len(self.health), len(self.summaries)
+        )
+        i = _BIN_HEADER_SIZE
+        buffer[i : i + len(thing_id)] = thing_id
+        i += len(thing_id)
+        for health in self.health:
+            struct.pack_into(
+                _BIN_HEALTH, buffer, i, health["timestamp"],
+                round(health["vsys"] * 1000), round(health["temperature"] * 100)
+            )
+            i += _BIN_HEALTH_SIZE
+        for reading in self.readings:
+            noise = reading.get("reading-noise")
+            noise = _BIN_NO_NOISE if noise is None else min(
+                round(noise * 10), _BIN_NO_NOISE - 1
+            )
+            moisture = reading.get("moisture")
+            moisture = _BIN_NO_MOISTURE if moisture is None else round(moisture * 100)
+            struct.pack_into(
+                _BIN_READING, buffer, i, reading["sensor-id"],
+                reading["timestamp"], reading["reading-u16"], noise, moisture
+            )
+            i += _BIN_READING_SIZE
+        for summary in self.summaries:
+            struct.pack_into(
+                _BIN_SUMMARY, buffer, i, summary["sensor-id"],
+                summary["timestamp"], summary["window"], summary["count"],
+                summary["min"], summary["max"], summary["mean"],
+                summary["stddev"]
+            )
+            i += _BIN_SUMMARY_SIZE
+        return memoryview(buffer)[:size]
+
+    def payload(self) -> JSONPayload | memoryview | bytes:
+        """Get the batched telemetry message, encoded as JSON or binary and
+        compressed if it is at least compress_min bytes.
+
+        NOTE: An uncompressed JSON payload is encoded by the MQTT client,
+        straight into its packet buffer (see JSONPayload).
+
+        Returns:
+            JSON payload, view of the binary message or compressed message.
+        """
+        if self.binary:
+            message = self.encode()
+        else:
+            message = self._payload.set(self.message())
+        if self.compress_min and len(message) >= self.compress_min:
+            return self._compress(message)
+        return message
+
+    def _compress(self, message: JSONPayload | memoryview) -> bytes:
+        """Deflate compress a binary or JSON message, after a binary
+        header with the content encoding flags set."""
+        header = bytearray(_BIN_HEADER_SIZE)
+        struct.pack_into(
+            _BIN_HEADER, header, 0, SCHEMA_VERSION, _FLAG_DEFLATE,
+            len(self._thing_id), len(self.readings), len(self.health),
+            len(self.summaries)
+        )
+        if self.binary:
+            body = message[_BIN_HEADER_SIZE:]
+        else:
+            header[1] |= _FLAG_JSON
+            if len(self._buffer) < len(message):
+                self._buffer = bytearray(len(message))
+            message.pack_into(self._buffer)
+            body = memoryview(self._buffer)[: len(message)]
+        stream = io.BytesIO()
+        stream.write(header)
+        with deflate.DeflateIO(stream, deflate.RAW, _DEFLATE_WBITS) as d:
+            d.write(body)
+        return stream.getvalue()
+
+    def release(self) -> None:
+        """Stop reusing the buffer & JSON payload of the last message,
+        which is still held by the MQTT client for retransmission."""
+        self._buffer = bytearray(0)
+        self._payload = JSONPayload()
+
+    def clear(self) -> None:
+        """Remove all cycles from the batch, once published."""
+        self.readings = []
+        self.health = []
+        self.summaries = []
+        self.cycles = 0
+
+
+def read_health() -> dict:
+    """Read system health values.
+
+    Returns:
+        A dict containing system health data:
+
+        {
+            "timestamp": timestamp,
+            "vsys": vsys voltage,
+            "temperature": internal temperature in degrees Celsius,
+        }
+    """
+    return {
+        "timestamp": time.mktime(time.gmtime()),
+        "vsys": read_vsys(),
+        "temperature": read_internal_temperature(),
+    }
 
 
 def read_internal_temperature() -> float:
     """Read the internal RP2040 temperature sensor 
     ADC value and convert to degrees Celsius.
+
+    NOTE: The temperature sensor is ADC channel 4, which is internal and
+    not connected to a GPIO pin.
     
     Returns (float):
         Temperature in degrees Celsius
     """
 
-    analog_sensor = ADC(Pin(4, Pin.IN))
-    sleep_ms(250)
+    analog_sensor = ADC(4)
     reading = analog_sensor.read_u16()
     voltage = (3.3 / 65535) * reading
     temperature = 27 - (voltage - 0.706) / 0.001721
@@ -45,15 +458,25 @@ def read_internal_temperature() -> float:
 
 
 def read_vsys() -> float:
-    """Measure vsys by setting GP29 to Pin.IN and using it to read ADC3
+    """Measure vsys by setting GP29 to Pin.IN and using it to read ADC3.
+
+    NOTE: On a Pico W, GP29 is also the CYW43 wireless SPI clock. The
+    CYW43 is deselected (GP25 high) with interrupts disabled while vsys is
+    read, and GP29 is then restored to its SPI function.
 
     Info: https://www.coderdojotc.org/micropython/advanced-labs/15-measuring-vsys/
 
     Returns:
-        float: _description_
+        float: vsys voltage.
     """
-    vsys = ADC(Pin(29, Pin.IN))
-    conversion_factor = (3.3 / (65535)) * 3
-    reading = vsys.read_u16() * conversion_factor
+    irq = disable_irq()
+    try:
+        Pin(25, Pin.OUT, value=1)
+        vsys = ADC(Pin(29, Pin.IN))
+        conversion_factor = (3.3 / (65535)) * 3
+        reading = vsys.read_u16() * conversion_factor
+        Pin(29, Pin.ALT, pull=Pin.PULL_DOWN, alt=7)
+    finally:
+        enable_irq(irq)
 
-    return reading
\ No newline at end of file
+    return reading
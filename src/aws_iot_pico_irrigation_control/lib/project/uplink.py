@@ -0,0 +1,131 @@
+"""Uplink module contains a routing table, which maps each class of
+message published by the device to a topic on the AWS IoT Core message
+broker, or to an AWS IoT Basic Ingest topic.
+
+Basic Ingest topics ($aws/rules/<rule-name>/...) deliver a message
+straight to the named IoT rule, bypassing the message broker and its
+subscriptions, which lowers latency and messaging cost for messages only
+consumed by a rule, such as telemetry forwarded to Firehose.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Classes:
+    Uplink: Message class to MQTT topic routing table.
+
+Functions:
+    ingest_topic: Get the Basic Ingest topic for an IoT rule.
+
+Constants:
+    TELEMETRY (str): Telemetry message class.
+    HEALTH (str): System health message class.
+    RESPONSE (str): Command response message class.
+"""
+
+TELEMETRY = "telemetry"
+HEALTH = "health"
+RESPONSE = "response"
+
+_INGEST_PREFIX = b"$aws/rules/"
+
+
+def ingest_topic(rule: str | bytes, topic: bytes = b"") -> bytes:
+    """Get the Basic Ingest topic, which publishes to an IoT rule.
+
+    Args:
+        rule (str | bytes): IoT rule name.
+        topic (bytes, optional): Topic suffix, available to the rule SQL.
+
+    Returns:
+        Topic in the form $aws/rules/<rule>[/<topic>].
+    """
+    if isinstance(rule, str):
+        rule = rule.encode()
+    if topic:
+        return _INGEST_PREFIX + rule + b"/" + topic
+    return _INGEST_PREFIX + rule
+
+
+class Uplink:
+    """Routing table, which maps uplink message classes to the topic their
+    messages are published to.
+
+    Each message class has a broker topic and, optionally, a Basic Ingest
+    topic or IoT rule. Classes named in ingest are routed to their Basic
+    Ingest topic, all others to the message broker. Fixed topics are
+    resolved when routes are added, so no topic is built per message.
+
+    Args:
+        ingest (tuple, optional): Message classes routed to Basic Ingest.
+    """
+
+    def __init__(self, ingest: tuple[str, ...] = ()):
+        self.ingest = ingest
+        self._topics = {}
+        self._rules = {}
+
+    def add(
+            self,
+            message_class: str,
+            topic: bytes | None = None,
+            ingest: bytes | None = None,
+            rule: str | None = None
+        ) -> None:
+        """Add the route of a message class.
+
+        Args:
+            message_class (str): Message class e.g. TELEMETRY.
+            topic (bytes, optional): Broker topic, or None for messages
+                published to a topic given per message (RESPONSE).
+            ingest (bytes, optional): Basic Ingest topic of the class.
+            rule (str, optional): IoT rule name, for messages published to
+                a topic given per message, as a Basic Ingest topic suffix.
+        """
+        routed = message_class in self.ingest
+        if routed and ingest is None and rule is None:
+            raise ValueError(f"No Basic Ingest route for {message_class}")
+        if routed and ingest is not None:
+            topic = ingest
+        elif routed and topic is not None:
+            topic = ingest_topic(rule, topic)
+        self._topics[message_class] = topic
+        if routed and topic is None:
+            self._rules[message_class] = rule
+
+    def topic(self, message_class: str, topic: bytes | None = None) -> bytes:
+        """Get the topic to publish a message of a class to.
+
+        Args:
+            message_class (str): Message class e.g. TELEMETRY.
+            topic (bytes, optional): Topic given per message, e.g. the
+                response topic of a command message.
+
+        Raises:
+            KeyError: If no route was added for message_class.
+
+        Returns:
+            MQTT topic.
+        """
+        routed = self._topics[message_class]
+        if routed is not None:
+            return routed
+        rule = self._rules.get(message_class)
+        if rule is not None:
+            return ingest_topic(rule, topic)
+        return topic
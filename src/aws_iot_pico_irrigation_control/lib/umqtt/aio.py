@@ -0,0 +1,366 @@
+import asyncio
+import struct
+import time
+from . import simple
+from .backoff import Backoff
+from .simple import MQTTException
+
+
+# Asyncio variant of umqtt.robust.MQTTClient. Socket I/O goes through
+# asyncio streams, so a slow TLS write or a reconnect yields to other
+# tasks rather than stalling the event loop. Each packet is written with
+# a single stream write, reads are serialised by a lock and PUBACK/SUBACK
+# packets are matched to their packet id, whichever task reads them.
+class MQTTClient(simple.MQTTClient):
+    DELAY = 2
+    DEBUG = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reader = None
+        self.writer = None
+        self.sock = None
+        self.rlock = asyncio.Lock()
+        self.wlock = asyncio.Lock()
+        self.clock = asyncio.Lock()
+        self.conn_id = 0
+        # replace to tune reconnect backoff, see backoff.Backoff
+        self.backoff = Backoff(self.DELAY)
+        self.last_tx = time.ticks_ms()
+        self.ping_ms = 0
+        self.dead_links = 0
+
+    async def delay(self, s):
+        await asyncio.sleep(s)
+
+    def log(self, in_reconnect, e):
+        if self.DEBUG:
+            if in_reconnect:
+                print("mqtt reconnect: %r" % e)
+            else:
+                print("mqtt: %r" % e)
+
+    # Raise OSError rather than AttributeError if the connection was
+    # closed, so the caller's reconnect path runs.
+    def _connected(self):
+        if self.writer is None or self.reader is None:
+            raise OSError(-1)
+
+    async def _write(self, pkt):
+        async with self.wlock:
+            self._connected()
+            self.writer.write(pkt)
+            await self._drain()
+
+    async def _drain(self):
+        await self.writer.drain()
+        self.last_tx = time.ticks_ms()
+
+    async def _readinto(self, mv):
+        n = 0
+        while n < len(mv):
+            # the connection may be closed by another task between reads
+            self._connected()
+            r = await self.reader.readinto(mv[n:])
+            if not r:
+                raise OSError(-1)
+            n += r
+
+    # Stream.close() does not close the socket (only wait_closed() does),
+    # so the socket is closed directly. A task blocked reading it wakes
+    # with OSError, releasing the read lock for the next connection.
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.reader = self.writer = self.sock = None
+
+    # A failed or cancelled connect closes the partially open connection.
+    # If _conn is given, the connection is only replaced if it is still
+    # the one identified by _conn.
+    async def connect(self, clean_session=True, timeout=None, _conn=None):
+        async with self.clock:
+            if _conn is not None and _conn != self.conn_id:
+                return None
+            try:
+                return await self._connect(clean_session, timeout)
+            except BaseException:
+                self._close()
+                raise
+
+    async def _connect(self, clean_session, timeout):
+        self._close()
+        start = time.ticks_ms()
+        conn = asyncio.open_connection(self.server, self.port, ssl=self.ssl)
+        if timeout is not None:
+            conn = asyncio.wait_for(conn, timeout)
+        self.reader, self.writer = await conn
+        # the stream socket, which _close closes directly
+        self.sock = self.writer.s
+
+        await self._write(self._pack_connect(clean_session))
+
+        hdr = self.rbuf_mv[:2]
+        await self._readinto(hdr)
+        assert self.rbuf[0] == 0x20
+        sz = self.rbuf[1]
+        if sz & 0x80:  # MQTT 5.0 CONNACK properties
+            await self._readinto(hdr[1:])
+            sz = (sz & 0x7F) | self.rbuf[1] << 7
+        assert sz <= len(self.rbuf)
+        body = self.rbuf_mv[:sz]
+        await self._readinto(body)
+        session_present = self._connack(body)
+        self.handshake_ms = time.ticks_diff(time.ticks_ms(), start)
+        self.acks = {}
+        if clean_session:
+            self.inflight.clear()
+        else:
+            await self._resend()
+        if not session_present:
+            self.rcvd.clear()
+        self.pings = 0
+        self.conn_id += 1
+        return session_present
+
+    async def disconnect(self):
+        try:
+            await self._write(b"\xe0\0")
+            await self.writer.wait_closed()
+        finally:
+            self._close()
+
+    async def ping(self):
+        await self._write(b"\xc0\0")
+        if not self.pings:
+            self.ping_ms = self.last_tx
+        self.pings += 1
+
+    # Keepalive task. Sends PINGREQ once nothing has been sent for
+    # interval seconds (half the keepalive by default), so an active
+    # link is never pinged. If a PINGRESP is outstanding for timeout
+    # seconds, the link is declared dead, closed and reconnected.
+    # PINGRESP is read by whichever task is processing incoming messages.
+    # Errors, including a connection closed by another task or a refused
+    # CONNACK, are logged and retried after a delay.
+    async def keepalive_task(self, interval=0, timeout=10):
+        interval_ms = int((interval or self.keepalive / 2) * 1000)
+        timeout_ms = int(timeout * 1000)
+        while 1:
+            conn = self.conn_id
+            if self.writer is None:
+                await asyncio.sleep_ms(interval_ms)
+                continue
+            now = time.ticks_ms()
+            try:
+                if self.pings:
+                    wait = timeout_ms - time.ticks_diff(now, self.ping_ms)
+                    if wait <= 0:
+                        self.log(False, "PINGRESP timeout")
+                        self.dead_links += 1
+                        self.pings = 0
+                        self._close()
+                        await self._reconnect(conn)
+                        continue
+                else:
+                    wait = interval_ms - time.ticks_diff(now, self.last_tx)
+                    if wait <= 0:
+                        await self.ping()
+                        continue
+            except (OSError, MQTTException) as e:
+                self.log(False, e)
+                await self.delay(self.DELAY)
+                continue
+            await asyncio.sleep_ms(wait)
+
+    # Reconnect with backoff between attempts, until connected or another
+    # task replaces the connection. Cancelling the calling task stops it
+    # cleanly, as any await may raise CancelledError.
+    async def reconnect(self):
+        conn = self.conn_id
+        self.backoff.start()
+        while conn == self.conn_id:
+            try:
+                ret = await self.connect(False, _conn=conn)
+                if ret is not None:
+                    self.backoff.succeeded()
+                return ret
+            except OSError as e:
+                self.log(True, e)
+                delay = self.backoff.failed()
+                if delay is None:
+                    raise
+                await self.delay(delay)
+
+    # Reconnect unless another task already replaced the connection
+    # identified by conn.
+    async def _reconnect(self, conn):
+        if conn == self.conn_id:
+            await self.reconnect()
+
+    async def _wait_ack(self, pid):
+        while pid not in self.acks:
+            await self._wait_msg(lambda: pid in self.acks)
+        return self.acks.pop(pid)
+
+    def _window_open(self):
+        return len(self.inflight) < self.max_inflight
+
+    def _inflight_empty(self):
+        return not self.inflight
+
+    async def _wait_window(self):
+        while not self._window_open():
+            await self._wait_msg(self._window_open)
+
+    # The packet buffer is shared, so the packet is built and handed to
+    # the stream (which copies anything it cannot send at once) while the
+    # write lock is held.
+    async def _send_publish(self, topic, msg, retain, qos, pid, dup=False):
+        async with self.wlock:
+            self._connected()
+            pkt, whole = self._pack_publish(topic, msg, retain, qos, pid, dup)
+            self.writer.write(pkt)
+            if not whole:
+                self.writer.write(msg)
+            await self._drain()
+
+    async def _send_ack(self, op, pid):
+        async with self.wlock:
+            self._connected()
+            self.ack_pkt[0] = op
+            struct.pack_into("!H", self.ack_pkt, 2, pid)
+            self.writer.write(self.ack_pkt)
+            await self._drain()
+
+    async def _resend(self):
+        for pid, entry in list(self.inflight.items()):
+            if entry is None:
+                await self._send_ack(0x62, pid)
+            else:
+                topic, msg, retain, qos = entry
+                await self._send_publish(topic, msg, retain, qos, pid, True)
+
+    async def _publish(self, topic, msg, retain, qos):
+        # never sent, so not added to the in-flight table
+        self._connected()
+        pid = 0
+        if qos > 0:
+            pid = self._next_pid()
+            self.inflight[pid] = (topic, msg, retain, qos)
+        await self._send_publish(topic, msg, retain, qos, pid)
+        if qos > 0:
+            await self._wait_window()
+
+    # A QoS 1 or 2 publish returns once sent, unless max_inflight
+    # publishes are already unacknowledged. If sending failed it stays in
+    # the in-flight table, which reconnect retransmits. A publish made
+    # while disconnected is sent again after reconnecting.
+    async def publish(self, topic, msg, retain=False, qos=0):
+        conn = self.conn_id
+        queued = qos > 0 and self.writer is not None
+        try:
+            return await self._publish(topic, msg, retain, qos)
+        except OSError as e:
+            self.log(False, e)
+        await self._reconnect(conn)
+        if not queued:
+            return await self.publish(topic, msg, retain, qos)
+        await self._retry(self._wait_window)
+
+    # Wait until every in-flight publish has been acknowledged.
+    async def wait_inflight(self):
+        await self._retry(self._wait_inflight)
+
+    async def _wait_inflight(self):
+        while self.inflight:
+            await self._wait_msg(self._inflight_empty)
+
+    async def _retry(self, f):
+        while 1:
+            conn = self.conn_id
+            try:
+                return await f()
+            except OSError as e:
+                self.log(False, e)
+            await self._reconnect(conn)
+
+    async def subscribe(self, topic, qos=0):
+        await self.subscribe_many(((topic, qos),))
+
+    # Subscribe to a list of (topic filter, qos) pairs with a single
+    # SUBSCRIBE packet, so one SUBACK round trip covers every filter.
+    # Returns the granted QoS of each topic filter.
+    async def subscribe_many(self, topics):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._next_pid()
+        await self._write(self._pack_subscribe(pid, topics))
+        rcs = await self._wait_ack(pid)
+        for rc in rcs:
+            if rc >= 0x80:
+                raise MQTTException(rc)
+        return rcs
+
+    # Read a single MQTT packet and process it. Returns early if the
+    # condition done() was met by another task while this one was
+    # waiting for the read lock.
+    async def _wait_msg(self, done=None):
+        async with self.rlock:
+            if done is not None and done():
+                return None
+            hdr = self.rbuf_mv[:2]
+            await self._readinto(hdr)
+            op = self.rbuf[0]
+            b = self.rbuf[1]
+            sz = b & 0x7F
+            sh = 7
+            while b & 0x80:
+                await self._readinto(hdr[1:])
+                b = self.rbuf[1]
+                sz |= (b & 0x7F) << sh
+                sh += 7
+            if sz > self.max_payload:
+                reply, pid = await self._stream(op, sz)
+            else:
+                body = self._body(sz)
+                await self._readinto(body)
+                reply, pid = self._handle(op, body)
+            if reply:
+                await self._send_ack(reply, pid)
+            if op == 0xD0:  # PINGRESP
+                return None
+            return op
+
+    # See simple.MQTTClient._stream, the chunk callback is not awaited.
+    async def _stream(self, op, sz):
+        mv = self.rbuf_mv
+        i = n = 0
+        if op & 0xF0 == 0x30:
+            k = 2
+            while k > 0:
+                await self._readinto(mv[n : n + k])
+                n += k
+                k = self._stream_need(op, sz, n)
+            if not k:
+                i = n
+        topic, pid, deliver = self._stream_head(op, i)
+        chunk = mv[i : i + self.chunk_size]
+        total = sz - n
+        off = 0
+        while off < total:
+            c = chunk[: min(len(chunk), total - off)]
+            await self._readinto(c)
+            if deliver:
+                self.chunk_cb(topic, c, off, total)
+            off += len(c)
+        if not i:
+            return 0, 0
+        return self._pub_reply(op, pid)
+
+    # Wait for a single incoming MQTT message and process it, yielding
+    # to other tasks while no data is available. Subscribed messages are
+    # delivered to the callback set by .set_callback().
+    async def wait_msg(self):
+        return await self._retry(self._wait_msg)
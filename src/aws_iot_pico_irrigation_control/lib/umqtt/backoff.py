@@ -0,0 +1,39 @@
+import random
+import time
+
+
+# Reconnect policy: exponential backoff from base seconds, capped at
+# max_delay, with up to jitter (0 - 1) of each delay randomised away so
+# that devices do not reconnect in lockstep. max_attempts (0 for no limit)
+# caps the attempts of a single reconnect run. Counters record attempts
+# and the time taken to reconnect.
+class Backoff:
+    def __init__(self, base=2, max_delay=60, factor=2, jitter=0.5, max_attempts=0):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.total_attempts = 0
+        self.reconnects = 0
+        self.reconnect_ms = 0
+        self.started = 0
+
+    def start(self):
+        self.attempts = 0
+        self.started = time.ticks_ms()
+
+    # Record a failed attempt. Returns the delay in seconds before the
+    # next attempt, or None once max_attempts is reached.
+    def failed(self):
+        self.attempts += 1
+        self.total_attempts += 1
+        if self.max_attempts and self.attempts >= self.max_attempts:
+            return None
+        delay = min(self.max_delay, self.base * self.factor ** (self.attempts - 1))
+        return delay * (1 - self.jitter * random.getrandbits(16) / 65536)
+
+    def succeeded(self):
+        self.reconnects += 1
+        self.reconnect_ms = time.ticks_diff(time.ticks_ms(), self.started)
@@ -1,13 +1,19 @@
 import time
 from . import simple
+from .backoff import Backoff
 
 
 class MQTTClient(simple.MQTTClient):
     DELAY = 2
     DEBUG = False
 
-    def delay(self, i):
-        time.sleep(self.DELAY)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # replace to tune reconnect backoff, see backoff.Backoff
+        self.backoff = Backoff(self.DELAY)
+
+    def delay(self, s):
+        time.sleep(s)
 
     def log(self, in_reconnect, e):
         if self.DEBUG:
@@ -17,22 +23,46 @@ class MQTTClient(simple.MQTTClient):
                 print("mqtt: %r" % e)
 
     def reconnect(self):
-        i = 0
+        self.backoff.start()
         while 1:
             try:
-                return super().connect(False)
+                ret = super().connect(False)
+                self.backoff.succeeded()
+                return ret
             except OSError as e:
                 self.log(True, e)
-                i += 1
-                self.delay(i)
+                delay = self.backoff.failed()
+                if delay is None:
+                    raise
+                self.delay(delay)
 
     def publish(self, topic, msg, retain=False, qos=0):
         while 1:
+            queued = qos > 0 and self.sock is not None
             try:
                 return super().publish(topic, msg, retain, qos)
             except OSError as e:
                 self.log(False, e)
             self.reconnect()
+            if queued:
+                # already in the in-flight table, resent by reconnect
+                return self.wait_window()
+
+    def wait_window(self):
+        while 1:
+            try:
+                return self._wait_window()
+            except OSError as e:
+                self.log(False, e)
+            self.reconnect()
+
+    def wait_inflight(self):
+        while 1:
+            try:
+                return super().wait_inflight()
+            except OSError as e:
+                self.log(False, e)
+            self.reconnect()
 
     def wait_msg(self):
         while 1:
@@ -0,0 +1,71 @@
+# Topic router. Topic filters, which may contain + (single level) and
+# # (remaining levels) wildcards, are compiled into a trie of topic
+# levels when added, so an incoming topic is matched by walking its
+# levels once rather than comparing it against every filter. Use the
+# router as the client callback and subscribe to all of its filters in
+# one SUBSCRIBE packet:
+#
+#   router = Router()
+#   router.add(b"cmd/zone/+", on_zone, qos=1)
+#   client.set_callback(router.dispatch)
+#   client.subscribe_many(router.filters())
+class Router:
+    def __init__(self, default=None):
+        # trie node: [children keyed by topic level, handlers]
+        self.root = [{}, []]
+        self.subs = []
+        # called with messages no filter matches
+        self.default = default
+
+    def add(self, topic_filter, handler, qos=0):
+        if isinstance(topic_filter, str):
+            topic_filter = topic_filter.encode()
+        levels = topic_filter.split(b"/")
+        for i, level in enumerate(levels):
+            assert level == b"#" and i == len(levels) - 1 or b"#" not in level
+            assert level == b"+" or b"+" not in level
+        node = self.root
+        for level in levels:
+            children = node[0]
+            if level not in children:
+                children[level] = [{}, []]
+            node = children[level]
+        node[1].append(handler)
+        self.subs.append((topic_filter, qos))
+
+    # (topic filter, qos) pairs for client.subscribe_many
+    def filters(self):
+        return self.subs
+
+    # Handlers of every filter matching topic. Wildcards at the first
+    # level do not match topics starting with $, as per the MQTT spec.
+    def match(self, topic):
+        levels = bytes(topic).split(b"/")
+        out = []
+        self._match(self.root, levels, 0, levels[0][:1] == b"$", out)
+        return out
+
+    def _match(self, node, levels, i, sys, out):
+        children = node[0]
+        if not (i == 0 and sys):
+            n = children.get(b"#")
+            if n is not None:
+                out.extend(n[1])
+        if i == len(levels):
+            out.extend(node[1])
+            return
+        if not (i == 0 and sys):
+            n = children.get(b"+")
+            if n is not None:
+                self._match(n, levels, i + 1, sys, out)
+        n = children.get(levels[i])
+        if n is not None:
+            self._match(n, levels, i + 1, sys, out)
+
+    # Client callback, topic and msg are passed on to the handlers as is.
+    def dispatch(self, topic, msg):
+        handlers = self.match(topic)
+        if not handlers and self.default is not None:
+            self.default(topic, msg)
+        for f in handlers:
+            f(topic, msg)
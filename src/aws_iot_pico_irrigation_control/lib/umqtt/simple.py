@@ -1,5 +1,6 @@
 import socket
 import struct
+import time
 from binascii import hexlify
 
 
@@ -17,6 +18,14 @@ class MQTTClient:
         password=None,
         keepalive=0,
         ssl=None,
+        pkt_size=512,
+        max_inflight=1,
+        rbuf_size=512,
+        max_payload=0,
+        chunk_size=128,
+        version=4,
+        session_expiry=0,
+        topic_aliases=8,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -34,24 +43,433 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.pkt = bytearray(pkt_size)
+        self.pkt_mv = memoryview(self.pkt)
+        # QoS > 0 publishes awaiting acknowledgement, keyed by packet id.
+        # A QoS 2 entry becomes None once PUBREC arrives (awaiting PUBCOMP).
+        self.inflight = {}
+        self.max_inflight = max_inflight
+        # ids of received QoS 2 messages awaiting PUBREL
+        self.rcvd = set()
+        self.ack_pkt = bytearray(b"\0\x02\0\0")
+        # SUBACK return codes (one per topic filter), keyed by packet id
+        self.acks = {}
+        # PINGREQs awaiting PINGRESP
+        self.pings = 0
+        # duration of the last connect (TCP, TLS handshake and CONNACK)
+        self.handshake_ms = 0
+        # receive buffer, packets are parsed in place
+        self.rbuf = bytearray(rbuf_size)
+        self.rbuf_mv = memoryview(self.rbuf)
+        # Packets larger than the receive buffer are allocated whole up to
+        # max_payload bytes. Larger ones are read in chunk_size pieces and
+        # PUBLISH payloads passed to the chunk callback, or discarded.
+        assert chunk_size < rbuf_size
+        self.max_payload = max(max_payload, rbuf_size)
+        self.chunk_size = chunk_size
+        self.chunk_cb = None
+        self.discarded = 0
+        # MQTT 5.0 (version=5): session expiry interval in seconds, the
+        # number of topic aliases to use (up to the server maximum), and
+        # the CONNACK properties and reason code of the last rejected
+        # publish, by property identifier.
+        assert version in (4, 5)
+        self.version = version
+        self.session_expiry = session_expiry
+        self.topic_aliases = topic_aliases
+        self.alias_max = 0
+        self.aliases = {}
+        self.server_props = {}
+        self.rejected = 0
+        self.reason = 0
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    @staticmethod
+    def _pack_str(pkt, s):
+        if isinstance(s, str):
+            s = s.encode()
+        pkt.extend(struct.pack("!H", len(s)))
+        pkt.extend(s)
 
-    def _recv_len(self):
-        n = 0
-        sh = 0
+    @staticmethod
+    def _pack_fixed(op, body):
+        sz = len(body)
+        assert sz < 2097152
+        pkt = bytearray(5 + sz)
+        pkt[0] = op
+        i = 1
+        while sz > 0x7F:
+            pkt[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        i += 1
+        pkt[i : i + len(body)] = body
+        return memoryview(pkt)[: i + len(body)]
+
+    # Decode a variable byte integer at buf[i]. Returns it and the index
+    # after it.
+    @staticmethod
+    def _varint(buf, i):
+        n = sh = 0
         while 1:
-            b = self.sock.read(1)[0]
+            b = buf[i]
+            i += 1
             n |= (b & 0x7F) << sh
             if not b & 0x80:
-                return n
+                return n, i
             sh += 7
 
+    # Index after the MQTT 5.0 properties at buf[i].
+    def _skip_props(self, buf, i):
+        n, i = self._varint(buf, i)
+        return i + n
+
+    # Parse the MQTT 5.0 properties at buf[i] into a dict keyed by
+    # property identifier. User properties are skipped.
+    def _props(self, buf, i):
+        n, i = self._varint(buf, i)
+        end = i + n
+        props = {}
+        while i < end:
+            p = buf[i]
+            i += 1
+            if p in (0x01, 0x17, 0x19, 0x24, 0x25, 0x28, 0x29, 0x2A):
+                v = buf[i]
+                i += 1
+            elif p in (0x13, 0x21, 0x22, 0x23):
+                v = buf[i] << 8 | buf[i + 1]
+                i += 2
+            elif p in (0x02, 0x11, 0x18, 0x27):
+                v = struct.unpack_from("!I", buf, i)[0]
+                i += 4
+            elif p == 0x0B:
+                v, i = self._varint(buf, i)
+            elif p == 0x26:  # user property, a string pair
+                for _ in range(2):
+                    i += 2 + (buf[i] << 8 | buf[i + 1])
+                continue
+            else:  # string or binary data
+                n = buf[i] << 8 | buf[i + 1]
+                v = bytes(buf[i + 2 : i + 2 + n])
+                i += 2 + n
+            props[p] = v
+        return props
+
+    # Build the CONNECT packet. In MQTT 5.0, clean_session is Clean Start
+    # and the session outlives the connection for session_expiry seconds.
+    def _pack_connect(self, clean_session):
+        body = bytearray(b"\0\x04MQTT\x04\0\0\0")
+        body[6] = self.version
+        body[7] = clean_session << 1
+        if self.user:
+            body[7] |= 0xC0
+        if self.keepalive:
+            assert self.keepalive < 65536
+            struct.pack_into("!H", body, 8, self.keepalive)
+        if self.lw_topic:
+            body[7] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            body[7] |= self.lw_retain << 5
+        if self.version == 5:
+            if self.session_expiry:
+                body.extend(struct.pack("!BBI", 5, 0x11, self.session_expiry))
+            else:
+                body.append(0)
+        self._pack_str(body, self.client_id)
+        if self.lw_topic:
+            if self.version == 5:
+                body.append(0)  # will properties
+            self._pack_str(body, self.lw_topic)
+            self._pack_str(body, self.lw_msg)
+        if self.user:
+            self._pack_str(body, self.user)
+            self._pack_str(body, self.pswd)
+        return self._pack_fixed(0x10, body)
+
+    # Process a CONNACK body. Raises MQTTException with the return (or
+    # reason) code if the connection was refused, else returns the session
+    # present flag. Topic aliases only last for a single connection.
+    def _connack(self, body):
+        if body[1]:
+            raise MQTTException(body[1])
+        self.aliases = {}
+        if self.version == 5:
+            props = self._props(body, 2)
+            self.server_props = props
+            self.alias_max = min(self.topic_aliases, props.get(0x22, 0))
+            # the server keep alive replaces the requested one
+            self.keepalive = props.get(0x13, self.keepalive)
+        return body[0] & 1
+
+    def _readinto(self, mv):
+        n = 0
+        while n < len(mv):
+            r = self.sock.readinto(mv[n:])
+            if not r:
+                raise OSError(-1)
+            n += r
+
+    # Returns a view of the receive buffer sized for a packet body, or of
+    # a new buffer if the body does not fit.
+    def _body(self, sz):
+        if sz > len(self.rbuf):
+            return memoryview(bytearray(sz))
+        return self.rbuf_mv[:sz]
+
+    # Process a received packet, whose body is a view of the receive
+    # buffer. PUBLISH topic and payload are passed to the callback as
+    # memoryviews, which must be copied if kept after it returns.
+    # Returns the type of packet to reply with (or 0) and its packet id.
+    def _handle(self, op, body):
+        if op & 0xF0 == 0x30:  # PUBLISH
+            tlen = body[0] << 8 | body[1]
+            i = 2 + tlen
+            qos = op & 6
+            pid = 0
+            if qos:
+                pid = body[i] << 8 | body[i + 1]
+                i += 2
+            if self.version == 5:
+                i = self._skip_props(body, i)
+            if self._fresh(op, pid):
+                self.cb(body[2 : 2 + tlen], body[i:])
+            return self._pub_reply(op, pid)
+        if op in (0x40, 0x50, 0x62, 0x70):  # PUBACK PUBREC PUBREL PUBCOMP
+            pid = body[0] << 8 | body[1]
+            # MQTT 5.0 reason code, omitted on success
+            rc = body[2] if len(body) > 2 else 0
+            return self._ack_state(op, pid, rc), pid
+        if op == 0x90:  # SUBACK
+            i = 2
+            if self.version == 5:
+                i = self._skip_props(body, i)
+            self.acks[body[0] << 8 | body[1]] = bytes(body[i:])
+        elif op == 0xD0:  # PINGRESP
+            self.pings = 0
+        elif op == 0xE0:  # DISCONNECT (MQTT 5.0)
+            self.reason = body[0] if body else 0
+        return 0, 0
+
+    # A QoS 2 message is only delivered once, until its PUBREL.
+    def _fresh(self, op, pid):
+        return op & 6 != 4 or pid not in self.rcvd
+
+    def _pub_reply(self, op, pid):
+        qos = op & 6
+        if qos == 2:
+            return 0x40, pid
+        if qos == 4:
+            self.rcvd.add(pid)
+            return 0x50, pid
+        return 0, 0
+
+    # Bytes of the variable header of a PUBLISH too large to be held in
+    # memory still to be read into the receive buffer, n bytes having been
+    # read. Returns 0 once complete, or -1 if the header and a chunk do not
+    # fit in the buffer.
+    def _stream_need(self, op, sz, n):
+        mv = self.rbuf_mv
+        i = 2
+        if n >= 2:
+            i += (mv[0] << 8 | mv[1]) + (op & 6 and 2)
+            if self.version == 5:
+                # properties, after their variable byte integer length
+                if n <= i:
+                    i += 1
+                else:
+                    j = i
+                    while j < n and mv[j] & 0x80:
+                        j += 1
+                    if j == n:
+                        i = n + 1
+                    else:
+                        i = self._skip_props(mv, i)
+        if i > sz or i + self.chunk_size > len(mv):
+            return -1
+        return i - n
+
+    # Topic and packet id of a streamed PUBLISH, whose variable header of
+    # i bytes is in the receive buffer (i is 0 if it could not be read),
+    # and whether its payload is passed to the chunk callback.
+    def _stream_head(self, op, i):
+        mv = self.rbuf_mv
+        if not i:
+            self.discarded += 1
+            return None, 0, False
+        t = 2 + (mv[0] << 8 | mv[1])
+        pid = mv[t] << 8 | mv[t + 1] if op & 6 else 0
+        if not self._fresh(op, pid):
+            return None, pid, False
+        if self.chunk_cb is None:
+            self.discarded += 1
+            return None, pid, False
+        return mv[2:t], pid, True
+
+    # Read a packet larger than max_payload in chunk_size pieces, so it is
+    # never allocated whole. The topic of a PUBLISH is read into the
+    # receive buffer and its payload passed to the chunk callback as
+    # (topic, chunk, offset, total), or discarded if no callback is set.
+    # Other packets are discarded. Returns the reply as _handle does.
+    def _stream(self, op, sz):
+        mv = self.rbuf_mv
+        i = n = 0
+        if op & 0xF0 == 0x30:
+            k = 2
+            while k > 0:
+                self._readinto(mv[n : n + k])
+                n += k
+                k = self._stream_need(op, sz, n)
+            if not k:
+                i = n
+        topic, pid, deliver = self._stream_head(op, i)
+        chunk = mv[i : i + self.chunk_size]
+        total = sz - n
+        off = 0
+        while off < total:
+            c = chunk[: min(len(chunk), total - off)]
+            self._readinto(c)
+            if deliver:
+                self.chunk_cb(topic, c, off, total)
+            off += len(c)
+        if not i:
+            return 0, 0
+        return self._pub_reply(op, pid)
+
+    # Build a PUBLISH packet in the preallocated packet buffer. Returns a
+    # view of the complete packet, or of the header only if the payload
+    # does not fit, in which case the payload must be written after it.
+    # In MQTT 5.0, topics are assigned topic aliases while available, so
+    # a topic is sent in full once per connection and then omitted.
+    # msg may be a payload object with a length and a pack_into(buf, i)
+    # method, which is encoded straight into the packet buffer.
+    def _pack_publish(self, topic, msg, retain, qos, pid, dup=False):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        alias = 0
+        if self.version == 5:
+            alias = self.aliases.get(topic, 0)
+            if alias:
+                topic = b""
+            elif len(self.aliases) < self.alias_max:
+                alias = len(self.aliases) + 1
+                self.aliases[topic] = alias
+        tlen = len(topic)
+        mlen = len(msg)
+        sz = 2 + tlen + mlen
+        if qos > 0:
+            sz += 2
+        if self.version == 5:
+            sz += 4 if alias else 1
+        assert sz < 2097152
+        # header: fixed header (up to 3 length bytes), topic, packet id
+        # and MQTT 5.0 properties
+        hdr = 4 + sz - mlen
+        if len(self.pkt) < hdr:
+            self.pkt = bytearray(hdr + mlen)
+            self.pkt_mv = memoryview(self.pkt)
+        pkt = self.pkt
+        mv = self.pkt_mv
+        pkt[0] = 0x30 | dup << 3 | qos << 1 | retain
+        i = 1
+        while sz > 0x7F:
+            pkt[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        struct.pack_into("!H", pkt, i + 1, tlen)
+        i += 3
+        mv[i : i + tlen] = topic
+        i += tlen
+        if qos > 0:
+            struct.pack_into("!H", pkt, i, pid)
+            i += 2
+        if self.version == 5:
+            if alias:
+                struct.pack_into("!BBH", pkt, i, 3, 0x23, alias)
+                i += 4
+            else:
+                pkt[i] = 0
+                i += 1
+        packed = hasattr(msg, "pack_into")
+        if i + mlen > len(pkt):
+            if not packed:
+                return mv[:i], False
+            self.pkt = bytearray(i + mlen)
+            self.pkt[:i] = pkt[:i]
+            pkt = self.pkt
+            mv = self.pkt_mv = memoryview(pkt)
+        if packed:
+            msg.pack_into(pkt, i)
+        else:
+            mv[i : i + mlen] = msg
+        return mv[: i + mlen], True
+
+    # Packet ids run from 1 to 65535, skipping those still in flight.
+    def _next_pid(self):
+        pid = self.pid % 65535 + 1
+        while pid in self.inflight:
+            pid = pid % 65535 + 1
+        self.pid = pid
+        return pid
+
+    def _send_publish(self, topic, msg, retain, qos, pid, dup=False):
+        pkt, whole = self._pack_publish(topic, msg, retain, qos, pid, dup)
+        # print(hex(len(pkt)), hexlify(pkt, ":"))
+        self.sock.write(pkt)
+        if not whole:
+            self.sock.write(msg)
+
+    def _send_ack(self, op, pid):
+        self.ack_pkt[0] = op
+        struct.pack_into("!H", self.ack_pkt, 2, pid)
+        self.sock.write(self.ack_pkt)
+
+    # Update the packet id state tables for a PUBACK, PUBREC, PUBREL or
+    # PUBCOMP packet. Returns the type of packet to reply with, or 0.
+    # A PUBACK or PUBREC reason code of 0x80 or more (MQTT 5.0) means the
+    # publish was rejected, which ends its flow.
+    def _ack_state(self, op, pid, rc=0):
+        if rc >= 0x80 and op in (0x40, 0x50):
+            self.rejected += 1
+            self.reason = rc
+            self.inflight.pop(pid, None)
+            return 0
+        if op == 0x50:  # PUBREC
+            if pid in self.inflight:
+                self.inflight[pid] = None
+            return 0x62
+        if op == 0x62:  # PUBREL
+            self.rcvd.discard(pid)
+            return 0x70
+        # PUBACK | PUBCOMP
+        self.inflight.pop(pid, None)
+        return 0
+
+    # Retransmit unacknowledged publishes with the DUP flag set, or
+    # PUBREL for QoS 2 publishes which have already been received.
+    def _resend(self):
+        for pid, entry in self.inflight.items():
+            if entry is None:
+                self._send_ack(0x62, pid)
+            else:
+                topic, msg, retain, qos = entry
+                self._send_publish(topic, msg, retain, qos, pid, True)
+
+    # Process incoming packets until fewer than max_inflight publishes
+    # await acknowledgement.
+    def _wait_window(self):
+        while len(self.inflight) >= self.max_inflight:
+            self.wait_msg()
+
     def set_callback(self, f):
         self.cb = f
 
+    # Callback for PUBLISH payloads larger than max_payload, called with
+    # (topic, chunk, offset, total) for each piece of the payload.
+    def set_chunk_callback(self, f):
+        self.chunk_cb = f
+
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
         assert topic
@@ -61,148 +479,126 @@ class MQTTClient:
         self.lw_retain = retain
 
     def connect(self, clean_session=True, timeout=None):
+        start = time.ticks_ms()
         self.sock = socket.socket()
         self.sock.settimeout(timeout)
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
         if self.ssl:
             self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user:
-            sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
-        assert resp[0] == 0x20 and resp[1] == 0x02
-        if resp[3] != 0:
-            raise MQTTException(resp[3])
-        return resp[2] & 1
+        self.sock.write(self._pack_connect(clean_session))
+        hdr = self.rbuf_mv[:2]
+        self._readinto(hdr)
+        assert self.rbuf[0] == 0x20
+        sz = self.rbuf[1]
+        if sz & 0x80:  # MQTT 5.0 CONNACK properties
+            self._readinto(hdr[1:])
+            sz = (sz & 0x7F) | self.rbuf[1] << 7
+        assert sz <= len(self.rbuf)
+        body = self.rbuf_mv[:sz]
+        self._readinto(body)
+        session_present = self._connack(body)
+        self.handshake_ms = time.ticks_diff(time.ticks_ms(), start)
+        if clean_session:
+            self.inflight.clear()
+        else:
+            self._resend()
+        if not session_present:
+            self.rcvd.clear()
+        return session_present
 
     def disconnect(self):
         self.sock.write(b"\xe0\0")
         self.sock.close()
+        self.sock = None
 
     def ping(self):
         self.sock.write(b"\xc0\0")
+        self.pings += 1
 
+    # Publish msg (str, bytes, bytearray or memoryview) with a single
+    # socket write, unless the payload exceeds the packet buffer.
+    # A QoS 1 or 2 publish is held in the in-flight table until its
+    # PUBACK or PUBREC arrives and only blocks while max_inflight
+    # publishes are unacknowledged, so msg must not be modified until then.
+    # Raises OSError if not connected, without adding to the table.
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        if self.sock is None:
+            raise OSError(-1)
+        pid = 0
         if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+            pid = self._next_pid()
+            self.inflight[pid] = (topic, msg, retain, qos)
+        self._send_publish(topic, msg, retain, qos, pid)
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            self._wait_window()
+
+    # Wait until every in-flight publish has been acknowledged.
+    def wait_inflight(self):
+        while self.inflight:
+            self.wait_msg()
+
+    # Build a SUBSCRIBE packet for a list of (topic filter, qos) pairs.
+    def _pack_subscribe(self, pid, topics):
+        body = bytearray(struct.pack("!H", pid))
+        if self.version == 5:
+            body.append(0)  # properties
+        for topic, qos in topics:
+            self._pack_str(body, topic)
+            body.append(qos)
+        return self._pack_fixed(0x82, body)
 
     def subscribe(self, topic, qos=0):
+        self.subscribe_many(((topic, qos),))
+
+    # Subscribe to a list of (topic filter, qos) pairs with a single
+    # SUBSCRIBE packet. Returns the granted QoS of each topic filter.
+    def subscribe_many(self, topics):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
-        while 1:
-            op = self.wait_msg()
-            if op == 0x90:
-                resp = self.sock.read(4)
-                # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
-                return
+        pid = self._next_pid()
+        self.sock.write(self._pack_subscribe(pid, topics))
+        while pid not in self.acks:
+            self.wait_msg()
+        rcs = self.acks.pop(pid)
+        for rc in rcs:
+            if rc >= 0x80:
+                raise MQTTException(rc)
+        return rcs
 
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
-    # messages processed internally.
+    # messages processed internally. The fixed header and body
+    # are read into the preallocated receive buffer with readinto.
     def wait_msg(self):
-        res = self.sock.read(1)
+        hdr = self.rbuf_mv[:2]
+        res = self.sock.readinto(hdr)
         self.sock.setblocking(True)
         if res is None:
             return None
-        if res == b"":
+        if res == 0:
             raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
-            assert sz == 0
+        if res == 1:
+            self._readinto(hdr[1:])
+        op = self.rbuf[0]
+        b = self.rbuf[1]
+        sz = b & 0x7F
+        sh = 7
+        while b & 0x80:
+            self._readinto(hdr[1:])
+            b = self.rbuf[1]
+            sz |= (b & 0x7F) << sh
+            sh += 7
+        if sz > self.max_payload:
+            reply, pid = self._stream(op, sz)
+        else:
+            body = self._body(sz)
+            self._readinto(body)
+            reply, pid = self._handle(op, body)
+        if reply:
+            self._send_ack(reply, pid)
+        if op == 0xD0:  # PINGRESP
             return None
-        op = res[0]
-        if op & 0xF0 != 0x30:
-            return op
-        sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
-        if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
-        self.cb(topic, msg)
-        if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
         return op
 
     # Checks whether a pending message from server is available.
@@ -27,6 +27,7 @@ Functions:
     garbage_collector: Coroutine for periodic garbage collection.
     handle_async_exception: Async exception handler.
     microdot_server: Serve a HTML form through a Microdot server.
+    replay_telemetry: Forward readings stored while offline.
     synchronise_time: Coroutine to set Network Time Protocol (NTP).
 
 Types:
@@ -58,6 +59,7 @@ from micropython import const
 from time import localtime
 
 from lib.microdot import Microdot, send_file
+from lib.project.calibration import CalibrationTable
 from lib.project.connection import (
     MQTTSecretsError,
     access_point_reset,
@@ -66,13 +68,26 @@ from lib.project.connection import (
     get_client_interface,
     get_network_interface,
 )
-from lib.project.irrigation import activate_solenoid, read_moisture_sensor
+from lib.project.encoder import JSONPayload
+from lib.project.irrigation import (
+    ReadingCache,
+    format_moisture_reading,
+    read_moisture_sensor,
+    scan_moisture_sensors,
+)
+from lib.project.sampling import MoistureSampler
+from lib.project.scheduler import ZoneScheduler
+from lib.project.series import ReadingSeries
+from lib.project.store import RECORD_SIZE, TelemetryStore
+from lib.project.telemetry import ReportPolicy, TelemetryBatch, read_health
+from lib.project.uplink import RESPONSE, TELEMETRY, Uplink
 from lib.project.utility import (
     debug_message,
     debug_network_status,
     dynamic_set_secret,
 )
-from lib.umqtt.robust import MQTTClient
+from lib.umqtt.aio import MQTTClient
+from lib.umqtt.router import Router
 
 # verbose debug messages flag
 _VERBOSE = const(True)
@@ -87,8 +102,8 @@ FunctionType = type(fn)
 
 
 def collect_message(
-        topic: bytes,
-        message: bytes,
+        topic: memoryview,
+        message: memoryview,
         queue: list,
         events: dict[str, asyncio.Event],
         verbose: bool = False
@@ -102,13 +117,18 @@ def collect_message(
     to the queue object. The async Task 'parse_message' awaiting
     this Event will continue, if the Event was not previously set.
 
+    NOTE: The MQTT client passes topic & message as views of its receive
+    buffer, which is reused for the next packet, so both are copied
+    before being queued.
+
     Args:
-        topic (bytes): MQTT topic a message was received from.
-        message (bytes): MQTT message.
+        topic (memoryview): MQTT topic a message was received from.
+        message (memoryview): MQTT message.
         queue (list): Object to append topic & message tuple to.
         events (dict): Event map for all coroutine Events.
         verbose (bool, optional): Enable verbose debug messages.
     """
+    topic, message = bytes(topic), bytes(message)
     debug_message(f"COLLECT MESSAGE FROM {topic.decode("ascii")}", verbose)
     queue.append((topic, message))
     events["parse_message"].set()
@@ -238,6 +258,9 @@ async def check_message(
     """A coroutine to check for new MQTT messages published to all
     subscribed topics.
 
+    NOTE: The asyncio MQTT client yields to other tasks while waiting for
+    incoming data, so messages are awaited rather than polled.
+
     Args:
         client (MQTTClient): A connected MQTT client instance.
         events (dict): Event map for all coroutine Events.
@@ -246,54 +269,139 @@ async def check_message(
     while True:
         await events["check_message"].wait()
         try:
-            client.check_msg()
+            await client.wait_msg()
         except Exception as e:
             debug_message(f"CHECK MESSAGE EXCEPTION: {e}", verbose)
             sys.print_exception(e)
-        await asyncio.sleep(1)
+            await asyncio.sleep(1)
 
 
 async def publish_telemetry(
         client: MQTTClient,
         topic: bytes,
+        store: TelemetryStore,
+        batch: TelemetryBatch,
+        sampler: MoistureSampler,
+        calibration: CalibrationTable,
+        series: ReadingSeries,
+        policy: ReportPolicy | None,
+        cache: ReadingCache,
         events: dict[str, asyncio.Event],
+        health: bool = False,
+        summary_cycles: int = 0,
         verbose: bool = False
     ) -> None:
     """Publishes moisture sensor readings from three capacitative moisture
-    sensors and publishes the readings as JSON to the specified MQTT topic.
-
-    NOTE: This coroutine awaits internal flag setting for 'publish_telemetry'
-    & 'connection_issue' Events. If the 'connection_issue' Event is cleared, 
-    function execution will pause, even though a timer will periodically set 
-    the 'telemetry_timer' Event flag.
+    sensors and publishes the readings as JSON, or in the binary encoding
+    of the batch, to the specified MQTT topic.
+
+    Readings of each sampling cycle, along with optional system health
+    values, are added to a TelemetryBatch and published as one message
+    once the batch size or flush interval is reached. Readings are also
+    appended to the in-RAM reading series. With summary_cycles, the window
+    summaries of the series are added every summary_cycles sampling
+    cycles, instead of the readings.
+
+    With a ReportPolicy, only readings which moved more than the deadband
+    from the last reported reading of their channel, or heartbeat readings,
+    are reported (and stored while offline). Cycles without readings to
+    report or summaries are skipped, and a change publishes the batch
+    straight away, rather than waiting for the batch size.
+
+    NOTE: This coroutine awaits internal flag setting for the
+    'publish_telemetry' Event. If the 'connection_issue' Event is cleared,
+    readings are appended to the flash-backed telemetry store instead and
+    the 'replay_telemetry' Event is set, so they are forwarded by the
+    'replay_telemetry' Task once the connection is restored.
 
     Args:
         client (MQTTClient): MQTT client
         topic (bytes): MQTT topic to publish telemetry data to.
+        store (TelemetryStore): Store for readings taken while offline.
+        batch (TelemetryBatch): Batch of sampling cycles to publish.
+        sampler (MoistureSampler): Moisture sensor sampling engine.
+        calibration (CalibrationTable): Moisture sensor calibration.
+        series (ReadingSeries): Recent readings & window aggregates.
+        policy (ReportPolicy | None): Reading reporting policy, or None to
+            report every reading.
+        cache (ReadingCache): Latest reading of each sensor, for commands.
         events (dict): Event map for all coroutine Events.
+        health (bool, optional): Add system health values to each cycle.
+        summary_cycles (int, optional): Sampling cycles per window summary,
+            or 0 to send readings.
         verbose (bool, optional): Enable verbose debug messages.
     """
+    cycles = 0
     while True:
         await events["publish_telemetry"].wait()
-        await events["connection_issue"].wait()
         debug_message(f"ASYNC TASK - PUBLISH TELEMETRY", verbose)
         try:
             debug_message(f"READING ADC 0-2 MOISTURE SENSORS", verbose)
-            messages = await asyncio.gather(
-                read_moisture_sensor(0, "irrigation-control"),
-                read_moisture_sensor(1, "irrigation-control"),
-                read_moisture_sensor(2, "irrigation-control"),
+            messages = await scan_moisture_sensors(
+                "irrigation-control", sampler, calibration=calibration
             )
+            for m in messages:
+                series.append(m["sensor-id"], m["timestamp"], m["reading-u16"])
+                cache.put(m)
+            cycles += 1
+            if policy is not None:
+                messages = policy.select(messages)
+
+            if not events["connection_issue"].is_set():
+                for m in messages:
+                    store.append(
+                        m["timestamp"], m["sensor-id"], m["reading-u16"]
+                    )
+                if messages:
+                    # one header write per cycle
+                    store.flush()
+                    events["replay_telemetry"].set()
+                debug_message(
+                    f"OFFLINE - STORED READINGS ({len(store)})", verbose
+                )
+                continue
 
-            # json.dumps(message, separators=(',', ':'))
-            messages = map(json.dumps, messages)
-            published = await asyncio.gather(
-                *[publish_message(client, topic, m, verbose) for m in messages]
-            )
+            summaries = None
+            if summary_cycles:
+                # window summaries replace readings, other than changes
+                if policy is None:
+                    messages = []
+                if cycles >= summary_cycles:
+                    cycles = 0
+                    summaries = series.summaries(sampler.scan_order)
+            if not messages and summaries is None:
+                debug_message(
+                    f"NO READINGS TO REPORT ({cycles}/{summary_cycles})",
+                    verbose
+                )
+                continue
+
+            batch.add(messages, read_health() if health else None, summaries)
+            changed = policy is not None and policy.changed
+            if not batch.ready() and not changed:
+                debug_message(
+                    f"BATCHED {batch.cycles}/{batch.size} CYCLES", verbose
+                )
+                continue
 
-            if any(published):
-                success = ("PARTIAL SUCCESS", "SUCCESS")[all(published)]
-                debug_message(f"ASYNC TASK - PUBLISH TELEMETRY {success}", verbose)
+            message = batch.payload()
+            if await publish_message(client, topic, message, verbose, qos=1):
+                batch.clear()
+                if await wait_inflight(client, verbose):
+                    debug_message(
+                        f"ASYNC TASK - PUBLISH TELEMETRY SUCCESS", verbose
+                    )
+                else:
+                    # retransmitted by the client on reconnect
+                    batch.release()
+            elif in_flight(client, message):
+                # retransmitted by the client on reconnect, so the batch
+                # starts over without reusing the buffers of the message
+                batch.release()
+                batch.clear()
+                debug_message(
+                    f"ASYNC TASK - PUBLISH TELEMETRY IN FLIGHT", verbose
+                )
             else:
                 debug_message(f"ASYNC TASK - PUBLISH TELEMETRY FAILURE", verbose)
         except asyncio.TimeoutError as e:
@@ -305,26 +413,120 @@ async def publish_telemetry(
             events["publish_telemetry"].clear()
 
 
-async def publish_message(
+async def replay_telemetry(
         client: MQTTClient,
         topic: bytes,
-        message: str,
+        store: TelemetryStore,
+        batch: TelemetryBatch,
+        events: dict[str, asyncio.Event],
+        budget: int,
         verbose: bool = False
+    ) -> None:
+    """Forward readings held in the telemetry store to the specified MQTT
+    topic, once the connection is restored.
+
+    Records are replayed in batches of at most budget bytes per loop
+    iteration. Each batch is published at QoS 1 as one batched telemetry
+    message, encoded & compressed as set for batch, and only removed from
+    the store once its PUBACK has arrived. A message left in flight by a
+    failure is retransmitted by the client, rather than replayed again, and
+    the next batch waits for its PUBACK. The coroutine yields between
+    batches, so a long backlog does not starve command handling, and backs
+    off after a failure.
+
+    NOTE: This coroutine awaits internal flag setting for the
+    'replay_telemetry' & 'connection_issue' Events. The 'replay_telemetry'
+    Event is cleared once the store is empty.
+
+    Args:
+        client (MQTTClient): MQTT client.
+        topic (bytes): MQTT topic to publish telemetry data to.
+        store (TelemetryStore): Store for readings taken while offline.
+        batch (TelemetryBatch): Batch used to build replayed messages.
+        events (dict): Event map for all coroutine Events.
+        budget (int): Maximum stored bytes replayed per loop iteration.
+        verbose (bool, optional): Enable verbose debug messages.
+    """
+    buffer = bytearray(max(budget // RECORD_SIZE, 1) * RECORD_SIZE)
+    # seconds to wait after a failed publish, doubled up to 32 seconds
+    retry_s = 1
+    # records of the replayed message awaiting its PUBACK
+    pending = 0
+    while True:
+        await events["replay_telemetry"].wait()
+        await events["connection_issue"].wait()
+        try:
+            if not pending:
+                n = store.read_records(buffer)
+                if not n:
+                    events["replay_telemetry"].clear()
+                    continue
+                debug_message(
+                    f"ASYNC TASK - REPLAY {n}/{len(store)} READINGS", verbose
+                )
+                readings = []
+                for i in range(n):
+                    timestamp, sensor_id, reading = store.unpack(buffer, i)
+                    readings.append(format_moisture_reading(
+                        sensor_id, "irrigation-control", timestamp, reading
+                    ))
+                batch.add(readings)
+                message = batch.payload()
+                batch.clear()
+                # a failed publish may be in flight, which the client
+                # retransmits on reconnect, rather than replayed again
+                published = await publish_message(
+                    client, topic, message, verbose, qos=1
+                )
+                if published or in_flight(client, message):
+                    pending = n
+            # records are kept in the store until acknowledged
+            if pending and await wait_inflight(client, verbose):
+                store.consume(pending)
+                pending = 0
+                retry_s = 1
+            else:
+                batch.release()
+                # the connection may not be restored yet, back off
+                debug_message(f"REPLAY FAILURE - RETRY IN {retry_s} S", verbose)
+                await asyncio.sleep(retry_s)
+                retry_s = min(retry_s * 2, 32)
+        except Exception as e:
+            debug_message(
+                f"ASYNC TASK - REPLAY TELEMETRY EXCEPTION {e}", verbose
+            )
+            sys.print_exception(e)
+            await asyncio.sleep(1)
+        # hand over to other async tasks between batches
+        await asyncio.sleep(0)
+
+
+async def publish_message(
+        client: MQTTClient,
+        topic: bytes,
+        message: str | bytes | JSONPayload,
+        verbose: bool = False,
+        qos: int = 0
     ) -> bool:
     """Publish a message to the specified MQTT topic.
 
+    NOTE: The message is passed to the MQTT client as is, which accepts
+    str, bytes, bytearray & memoryview payloads and builds the PUBLISH
+    packet in a preallocated buffer. A JSONPayload is encoded straight
+    into that buffer, after the header written from its known size.
+
     Args:
         client (MQTTClient): MQTT client.
         topic (bytes): MQTT message topic.
-        events (dict): Event map for all coroutine Events.
+        message (str | bytes | JSONPayload): MQTT message.
         verbose (bool, optional): Enable verbose debug messages.
+        qos (int, optional): MQTT QoS level.
 
     Returns:
         True if message published successfully, else False.
     """
     try:
-        message_b = bytes(message, "utf-8")
-        client.publish(topic, message_b)
+        await client.publish(topic, message, qos=qos)
     except Exception as e:
         debug_message(f"PUBLISH MESSAGE EXCEPTION: {e}", verbose)
         debug_message(f"MQTT TOPIC: {topic}", verbose)
@@ -333,14 +535,57 @@ async def publish_message(
     return True
 
 
+def in_flight(client: MQTTClient, message: object) -> bool:
+    """Check whether a QoS 1 message is held in the MQTT client in-flight
+    table after a failed publish, to be retransmitted on reconnect.
+
+    Args:
+        client (MQTTClient): MQTT client.
+        message (object): MQTT message passed to publish.
+
+    Returns:
+        True if the message is in flight, else False.
+    """
+    for entry in client.inflight.values():
+        if entry is not None and entry[1] is message:
+            return True
+    return False
+
+
+async def wait_inflight(client: MQTTClient, verbose: bool = False) -> bool:
+    """Wait until every in-flight QoS 1 message has been acknowledged.
+
+    Args:
+        client (MQTTClient): MQTT client.
+        verbose (bool, optional): Enable verbose debug messages.
+
+    Returns:
+        True if acknowledged, else False, with messages left in flight.
+    """
+    try:
+        await client.wait_inflight()
+    except Exception as e:
+        debug_message(f"WAIT IN FLIGHT EXCEPTION: {e}", verbose)
+        sys.print_exception(e)
+        return False
+    return True
+
+
 async def parse_message(
         client: MQTTClient, 
         events: dict[str, asyncio.Event], 
         command_queue: list[tuple[bytes, bytes]], 
+        uplink: Uplink,
+        sampler: MoistureSampler,
+        calibration: CalibrationTable,
+        series: ReadingSeries,
+        cache: ReadingCache,
+        scheduler: ZoneScheduler,
         verbose: bool = False
     ) -> None:
     """Parse an MQTT message from a queue and facilitate the task
-    indicated by the message command.
+    indicated by the message command. The response is published to the
+    topic the uplink routes the message response-topic to.
 
     MQTT command message schema:
         { 
@@ -352,14 +597,43 @@ async def parse_message(
 
     MQTT message["command"] examples:
         - { "type": "irrigation-zone", "zone-id": 1|2|3|4|5, "duration": 10 }
+        - { "type": "irrigation-zone", "zone-id": 1|2|3|4|5,
+            "action": "extend", "duration": 10 }
+        - { "type": "irrigation-zone", "zone-id": 1|2|3|4|5,
+            "action": "cancel" }
         - { "type": "sensor-reading", "sensor-id": 0|1|2 }
+        - { "type": "calibrate", "sensor-id": 0|1|2,
+            "point": "dry"|"wet"|"clear"|45.5 }
+        - { "type": "sensor-history", "sensor-id": 0|1|2, "count": 12 }
+
+    An irrigation-zone command starts (the default action), extends or
+    cancels a zone with the zone scheduler, which queues zones started
+    while the maximum number of zones are open. The response holds the
+    open & queued zones.
+
+    A calibrate command captures a calibration point of the sensor from a
+    live reading; a "dry" or "wet" endpoint, a curve point at a given
+    moisture % or "clear" to remove the sensor calibration. An invalid
+    sensor or point is answered with an "error" response. A
+    sensor-history command returns the latest telemetry readings of the
+    sensor & its window summaries, without reading the ADC. A
+    sensor-reading command returns the cached reading of the sensor, with
+    its "age-ms", if it is younger than the cache TTL.
 
     Args:
         client (MQTTClient): MQTT client instance.
         events (dict): Event map for all coroutine Events.
         command_queue (list): Queue containing MQTT topics & messages.
+        uplink (Uplink): Uplink message routing table.
+        sampler (MoistureSampler): Moisture sensor sampling engine.
+        calibration (CalibrationTable): Moisture sensor calibration.
+        series (ReadingSeries): Recent readings & window aggregates.
+        cache (ReadingCache): Latest reading of each sensor.
+        scheduler (ZoneScheduler): Irrigation zone scheduler.
         verbose (bool, optional): Enable verbose debug messages.
     """
+    # command responses are encoded into the MQTT client packet buffer
+    payload = JSONPayload()
     while True:
         # Event internal flag set by "collect_message" function
         await events["parse_message"].wait()
@@ -374,11 +648,56 @@ async def parse_message(
 
         command = message["command"]
         if command["type"] == "irrigation-zone":
-            await activate_solenoid(command["zone-id"], command["duration"])
+            action = command.get("action", "start")
+            try:
+                if action == "start":
+                    scheduler.start(command["zone-id"], command["duration"])
+                elif action == "extend":
+                    scheduler.extend(command["zone-id"], command["duration"])
+                elif action == "cancel":
+                    scheduler.cancel(command["zone-id"])
+                else:
+                    raise ValueError(f"Invalid zone action {action}")
+            except ValueError as e:
+                debug_message(f"IRRIGATION ZONE ERROR: {e}", verbose)
+                response["error"] = str(e)
+            response["irrigation-zone"] = scheduler.status()
         if command["type"] == "sensor-reading":
-            response["sensor-reading"] = await read_moisture_sensor(command["sensor-id"], "irrigation-control")
-
-        await publish_message(client, bytes(message["response-topic"], "utf-8"), json.dumps(response))
+            response["sensor-reading"] = await cache.get(
+                command["sensor-id"], "irrigation-control", sampler,
+                calibration
+            )
+        if command["type"] == "calibrate":
+            sensor = command["sensor-id"]
+            try:
+                # sensor-id comes from the message, checked before use
+                if sensor not in range(len(calibration.points)):
+                    raise ValueError(f"Invalid sensor {sensor}")
+                reading = await read_moisture_sensor(
+                    sensor, "irrigation-control", sampler
+                )
+                response["sensor-reading"] = reading
+                calibration.capture(
+                    sensor, command["point"], reading["reading-u16"]
+                )
+                calibration.save()
+                cache.invalidate(sensor)
+                response["calibration"] = calibration.describe(sensor)
+            except ValueError as e:
+                debug_message(f"CALIBRATION ERROR: {e}", verbose)
+                response["error"] = str(e)
+        if command["type"] == "sensor-history":
+            sensor = command["sensor-id"]
+            response["sensor-history"] = {
+                "sensor-id": sensor,
+                "readings": series.history(sensor, command.get("count", 12)),
+                "summaries": series.summaries((sensor,)),
+            }
+
+        response_topic = uplink.topic(
+            RESPONSE, bytes(message["response-topic"], "utf-8")
+        )
+        await publish_message(client, response_topic, payload.set(response))
         # if command_queue is empty reset Event internal flag
         if not command_queue:
             events["parse_message"].clear()
@@ -486,8 +805,93 @@ async def async_main(verbose: bool = False):
     _CMD_ZONE = const(b"cmd/irrigation/garden/irrigation-control/zone")
     _CMD_TELEMETRY = const(b"cmd/irrigation/garden/irrigation-control/telemetry")
 
-    # Telemetry timer (milliseconds)
-    _DT_TIMER_MS = const(3_600_00)
+    # Uplink message classes published to Basic Ingest topics, straight to
+    # their IoT rule, rather than through the message broker. Telemetry
+    # messages (including any system health values) go to the rule which
+    # feeds Firehose, command responses to the requested response topic.
+    _INGEST_CLASSES = (TELEMETRY,)
+    uplink = Uplink(_INGEST_CLASSES)
+    uplink.add(TELEMETRY, _DT_MOISTURE, ingest=_RULE_MOISTURE)
+    uplink.add(RESPONSE)
+    _TELEMETRY_TOPIC = uplink.topic(TELEMETRY)
+
+    # Telemetry sampling timer (milliseconds), readings are reported on
+    # change (see _REPORT_DEADBAND) so sensors are sampled more often
+    _DT_TIMER_MS = const(60_000)
+
+    # Telemetry batch size (sampling cycles), flush interval (milliseconds),
+    # system health values flag (reads vsys, which pauses the CYW43 SPI
+    # bus, see read_vsys), binary encoding flag (JSON if False,
+    # see tools/telemetry_decoder.py) & minimum size (bytes) of batched
+    # messages to deflate compress (0 to never compress)
+    _BATCH_SIZE = const(1)
+    _BATCH_INTERVAL_MS = const(0)
+    _BATCH_HEALTH = const(False)
+    _BATCH_BINARY = const(False)
+    _BATCH_COMPRESS_MIN = const(0)
+    telemetry_batch = TelemetryBatch(
+        "irrigation-control", _BATCH_SIZE, _BATCH_INTERVAL_MS,
+        _BATCH_BINARY, _BATCH_COMPRESS_MIN
+    )
+
+    # Moisture sensor samples per reading (16 - 256), sample spacing
+    # (microseconds) & maximum sensor power-on settle time (milliseconds)
+    _SAMPLE_BURST = const(64)
+    _SAMPLE_SPACING_US = const(200)
+    _SAMPLE_SETTLE_MS = const(250)
+    # Adaptive settle tolerance (u16 counts, 0 for a fixed settle time),
+    # poll interval (milliseconds) & consecutive polls within tolerance
+    _SETTLE_TOLERANCE = const(96)
+    _SETTLE_POLL_MS = const(10)
+    _SETTLE_COUNT = const(3)
+    # Telemetry scan order (power-on & read order) & delay between
+    # powering each sensor (milliseconds), to limit inrush current
+    _SCAN_ORDER = (0, 1, 2)
+    _SCAN_STAGGER_MS = const(5)
+    moisture_sampler = MoistureSampler(
+        _SAMPLE_BURST, _SAMPLE_SPACING_US, _SAMPLE_SETTLE_MS,
+        settle_tolerance=_SETTLE_TOLERANCE,
+        settle_poll_ms=_SETTLE_POLL_MS,
+        settle_count=_SETTLE_COUNT,
+        scan_order=_SCAN_ORDER,
+        stagger_ms=_SCAN_STAGGER_MS
+    )
+
+    # Offline telemetry store capacity (records) & replay budget (bytes)
+    _STORE_CAPACITY = const(1024)
+    _REPLAY_BUDGET = const(256)
+    telemetry_store = TelemetryStore("telemetry.bin", _STORE_CAPACITY)
+
+    # Moisture sensor calibration, captured by calibrate commands
+    calibration = CalibrationTable("calibration.bin")
+
+    # Recent readings held in RAM per sensor (readings), window sizes of
+    # rolling aggregates (readings) & sampling cycles per published window
+    # summary (0 to publish readings instead)
+    _SERIES_CAPACITY = const(120)
+    _SERIES_WINDOWS = (15, 120)
+    _SUMMARY_CYCLES = const(60)
+    reading_series = ReadingSeries(_SERIES_CAPACITY, _SERIES_WINDOWS)
+
+    # Reading deadband (u16 counts) & heartbeat interval (seconds); readings
+    # are only reported on a change beyond the deadband, or at the heartbeat
+    _REPORT_DEADBAND = const(512)
+    _REPORT_HEARTBEAT_S = const(3600)
+    report_policy = ReportPolicy(_REPORT_DEADBAND, _REPORT_HEARTBEAT_S)
+
+    # Maximum age (milliseconds) of a cached reading, returned by
+    # sensor-reading commands rather than reading the sensor again
+    _READING_TTL_MS = const(30_000)
+    reading_cache = ReadingCache(_READING_TTL_MS)
+
+    # Maximum irrigation zones open at once (12 V supply & water pressure
+    # limits), further zones are queued
+    _ZONES_MAX_OPEN = const(2)
+    zone_scheduler = ZoneScheduler(_ZONES_MAX_OPEN)
+    replay_batch = TelemetryBatch(
+        "irrigation-control", binary=_BATCH_BINARY,
+        compress_min=_BATCH_COMPRESS_MIN
+    )
 
     # event loop & exception handler setup
     event_loop = asyncio.get_event_loop()
@@ -499,6 +903,11 @@ async def async_main(verbose: bool = False):
     async_events["publish_telemetry"] = asyncio.Event()
     async_events["check_message"] = asyncio.Event()
     async_events["parse_message"] = asyncio.Event()
+    async_events["replay_telemetry"] = asyncio.Event()
+
+    # forward any readings stored before a restart
+    if len(telemetry_store):
+        async_events["replay_telemetry"].set()
 
     gc.collect()
 
@@ -508,13 +917,32 @@ async def async_main(verbose: bool = False):
         garbage_collector(verbose)
     )
     async_tasks["publish_telemetry"] = asyncio.create_task(
-        publish_telemetry(MQTT, _DT_MOISTURE, async_events, verbose)
+        publish_telemetry(
+            MQTT, _TELEMETRY_TOPIC, telemetry_store, telemetry_batch,
+            moisture_sampler, calibration, reading_series, report_policy,
+            reading_cache, async_events, _BATCH_HEALTH, _SUMMARY_CYCLES, verbose
+        )
     )
+    async_tasks["replay_telemetry"] = asyncio.create_task(
+        replay_telemetry(
+            MQTT, _TELEMETRY_TOPIC, telemetry_store, replay_batch,
+            async_events, _REPLAY_BUDGET, verbose
+        )
+    )
+    async_tasks["zone_scheduler"] = asyncio.create_task(zone_scheduler.run())
     async_tasks["check_message"] = asyncio.create_task(
         check_message(MQTT, async_events, verbose)
     )
     async_tasks["parse_message"] = asyncio.create_task(
-        parse_message(MQTT, async_events, command_queue, verbose)
+        parse_message(
+            MQTT, async_events, command_queue, uplink, moisture_sampler,
+            calibration, reading_series, reading_cache, zone_scheduler, verbose
+        )
+    )
+    # PINGREQ after 30 seconds idle, dead link after 10 seconds without
+    # PINGRESP (reconnects via the MQTT client)
+    async_tasks["keepalive"] = asyncio.create_task(
+        MQTT.keepalive_task(interval=30, timeout=10)
     )
 
     await asyncio.sleep(5)
@@ -547,9 +975,17 @@ async def async_main(verbose: bool = False):
 
 
     # MQTT client passes MQTT topic & message values to the callback
-    # function set with 'set_callback' method. 'wrap_callback' function
-    # passes extra parameters to the callback function.
-    MQTT.set_callback(wrap_callback(command_queue, async_events, verbose)(collect_message))
+    # function set with 'set_callback' method. The Router dispatches each
+    # message to the handler registered for the matching topic filter,
+    # with all topic filters subscribed to in a single SUBSCRIBE packet.
+    # 'wrap_callback' function passes extra parameters to the handler.
+    router = Router()
+    command_handler = wrap_callback(
+        command_queue, async_events, verbose
+    )(collect_message)
+    router.add(_CMD_ZONE, command_handler)
+    router.add(_CMD_TELEMETRY, command_handler)
+    MQTT.set_callback(router.dispatch)
 
     # check if WLAN connected in STA mode
     if not connection_issue(WLAN, WLAN_MODE, verbose):
@@ -557,12 +993,12 @@ async def async_main(verbose: bool = False):
         if await synchronise_time(verbose):
             debug_message(f"CONNECTING MQTT CLIENT", verbose)
             # ...then we can connect the MQTT client
-            MQTT.connect(clean_session=True)
+            await MQTT.connect(clean_session=True)
             # and subscribe to the relevant MQTT topics
-            MQTT.subscribe(_CMD_ZONE)
-            MQTT.subscribe(_CMD_TELEMETRY)
+            await MQTT.subscribe_many(router.filters())
 
             debug_message(f"MQTT CLIENT CONNECTED", verbose)
+            debug_message(f"MQTT HANDSHAKE: {MQTT.handshake_ms} MS", verbose)
             # we trigger MQTT message check Task coroutine
             async_events["check_message"].set()
             # we indicate no connection issues
@@ -617,11 +1053,14 @@ async def async_main(verbose: bool = False):
                 await asyncio.sleep(1)
                 # if NTP never synchronised
                 if (await synchronise_time(verbose)):
-                    if not (previous_session := MQTT.connect(clean_session=False)):
+                    previous_session = await MQTT.connect(clean_session=False)
+                    if not previous_session:
                         debug_message(f"NO PREVIOUS MQTT SESSION", verbose)
                         debug_message(f"SUBSCRIBING TO MQTT TOPICS", verbose)
-                        MQTT.subscribe(_CMD_ZONE)
-                        MQTT.subscribe(_CMD_TELEMETRY)
+                        await MQTT.subscribe_many(router.filters())
+                    debug_message(
+                        f"MQTT HANDSHAKE: {MQTT.handshake_ms} MS", verbose
+                    )
                     async_events["check_message"].set()
                 else:
                     debug_message(f"SYNCHRONISE TIME FAILED", verbose)
@@ -640,6 +1079,20 @@ async def async_main(verbose: bool = False):
             app.shutdown()
         except AttributeError:
             pass
+        # cancel Tasks, including any MQTT reconnect backoff in progress
+        telemetry_timer.deinit()
+        for task in async_tasks.values():
+            task.cancel()
+        debug_message(
+            f"MQTT RECONNECTS: {MQTT.backoff.reconnects} | "
+            f"ATTEMPTS: {MQTT.backoff.total_attempts} | "
+            f"LAST RECONNECT: {MQTT.backoff.reconnect_ms} MS | "
+            f"LAST HANDSHAKE: {MQTT.handshake_ms} MS | "
+            f"DEAD LINKS: {MQTT.dead_links} | "
+            f"DISCARDED MESSAGES: {MQTT.discarded} | "
+            f"REJECTED PUBLISHES: {MQTT.rejected} | "
+            f"LAST REASON CODE: {MQTT.reason:#04x}", verbose
+        )
         debug_message(f"DISCONNECT & DEACTIVATE WLAN INTERFACE", verbose)
         WLAN.disconnect()
         deactivate_interface(WLAN, verbose)
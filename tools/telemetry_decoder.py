@@ -0,0 +1,225 @@
+"""Telemetry decoder module, which turns batched telemetry messages
+published by the device back into records, for S3/Firehose consumers.
+
+Messages are either JSON or binary encoded (see TelemetryBatch in
+lib/project/telemetry.py). JSON messages start with '{', binary messages
+with the schema version. Deflate compressed messages of either encoding
+start with the binary header, whose flags give the content encoding.
+Basic Ingest rules should forward binary payloads base64 encoded, e.g.
+SELECT encode(*, 'base64') AS data.
+
+This module is pure Python (3.10+) and is not copied to the Pico.
+
+Usage:
+    python tools/telemetry_decoder.py [--base64] FILE [FILE ...]
+
+Each message file is decoded to JSON lines (one record per reading) on
+stdout.
+
+Author: Andrew Ridyard.
+
+License: GNU General Public License v3 or later.
+
+Copyright (C): 2024.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Functions:
+    decode: Decode a telemetry message.
+    records: Decode a telemetry message into reading records.
+
+Constants:
+    SCHEMA_VERSION (int): Latest telemetry message schema version.
+"""
+
+import argparse
+import base64
+import json
+import struct
+import sys
+import zlib
+
+SCHEMA_VERSION = 5
+
+# header flags: body is raw deflate compressed, body is JSON
+_FLAG_DEFLATE = 0x01
+_FLAG_JSON = 0x02
+
+# version 4 adds the summary count to the header & version 5 widens the
+# health & summary counts to u16
+_HEADER = struct.Struct("<BBBHB")
+_HEADER_V4 = struct.Struct("<BBBHBB")
+_HEADER_V5 = struct.Struct("<BBBHHH")
+_HEALTH = struct.Struct("<IHh")
+# binary reading layout of each schema version, version 2 adds noise
+# & version 3 moisture
+_READINGS = {
+    1: struct.Struct("<BIH"),
+    2: struct.Struct("<BIHH"),
+    3: struct.Struct("<BIHHH"),
+    4: struct.Struct("<BIHHH"),
+    5: struct.Struct("<BIHHH"),
+}
+_SUMMARY = struct.Struct("<BIHHHHff")
+_SUMMARY_FIELDS = (
+    "sensor-id", "timestamp", "window", "count", "min", "max", "mean", "stddev"
+)
+_NO_NOISE = 0xFFFF
+_NO_MOISTURE = 0xFFFF
+
+# ADC u16 reading to sensor voltage, as read_moisture_sensor
+_VCC_FACTOR = 3.3 / 65535 * 3
+
+
+def _decode_binary(payload: bytes) -> dict:
+    """Decode a binary encoded, or compressed, telemetry message."""
+    version = payload[0]
+    reading_struct = _READINGS.get(version)
+    if reading_struct is None:
+        raise ValueError(f"Unsupported schema version {version}")
+    if version >= 5:
+        header = _HEADER_V5
+    elif version == 4:
+        header = _HEADER_V4
+    else:
+        header = _HEADER
+    _, flags, id_size, n_readings, n_health, *n_summaries = header.unpack_from(
+        payload
+    )
+    n_summaries = n_summaries[0] if n_summaries else 0
+    if flags & _FLAG_DEFLATE:
+        body = zlib.decompress(payload[header.size :], wbits=-15)
+        if flags & _FLAG_JSON:
+            return json.loads(body)
+        payload = payload[: header.size] + body
+    i = header.size
+    thing_id = payload[i : i + id_size].decode()
+    i += id_size
+
+    health = []
+    for timestamp, vsys, temperature in _HEALTH.iter_unpack(
+        payload[i : i + n_health * _HEALTH.size]
+    ):
+        health.append({
+            "timestamp": timestamp,
+            "vsys": vsys / 1000,
+            "temperature": temperature / 100,
+        })
+    i += n_health * _HEALTH.size
+
+    readings = []
+    for sensor_id, timestamp, reading, *extra in reading_struct.iter_unpack(
+        payload[i : i + n_readings * reading_struct.size]
+    ):
+        record = {
+            "sensor-id": sensor_id,
+            "timestamp": timestamp,
+            "reading-u16": reading,
+            "reading-vcc": reading * _VCC_FACTOR,
+        }
+        if len(extra) > 0 and extra[0] != _NO_NOISE:
+            record["reading-noise"] = extra[0] / 10
+        if len(extra) > 1 and extra[1] != _NO_MOISTURE:
+            record["moisture"] = extra[1] / 100
+        readings.append(record)
+    i += n_readings * reading_struct.size
+
+    summaries = [
+        dict(zip(_SUMMARY_FIELDS, values))
+        for values in _SUMMARY.iter_unpack(
+            payload[i : i + n_summaries * _SUMMARY.size]
+        )
+    ]
+    if i + n_summaries * _SUMMARY.size != len(payload):
+        raise ValueError("Truncated or oversized telemetry message")
+
+    message = {
+        "schema-version": version,
+        "thing-id": thing_id,
+        "readings": readings,
+    }
+    if health:
+        message["health"] = health
+    if summaries:
+        message["summaries"] = summaries
+    return message
+
+
+def decode(payload: bytes | str) -> dict:
+    """Decode a telemetry message.
+
+    Args:
+        payload (bytes | str): JSON, binary or compressed message.
+
+    Raises:
+        ValueError: If the message is malformed or of an unknown schema
+            version.
+
+    Returns:
+        Batched telemetry message dict, as the JSON encoding.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    try:
+        return _decode_binary(payload)
+    except (IndexError, struct.error, UnicodeDecodeError, zlib.error) as e:
+        raise ValueError(f"Malformed telemetry message: {e}") from e
+
+
+def records(payload: bytes | str) -> list[dict]:
+    """Decode a telemetry message into one record per reading, each with
+    the "thing-id" of the message.
+
+    Args:
+        payload (bytes | str): JSON, binary or compressed message.
+
+    Returns:
+        List of reading records.
+    """
+    message = decode(payload)
+    return [
+        {"thing-id": message["thing-id"], **reading}
+        for reading in message["readings"]
+    ]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Decode telemetry message files and print their records as JSON.
+
+    Args:
+        argv (list, optional): Command line arguments, sys.argv if None.
+
+    Returns:
+        Exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="+", help="telemetry message files")
+    parser.add_argument(
+        "--base64", action="store_true", help="messages are base64 encoded"
+    )
+    args = parser.parse_args(argv)
+    for path in args.files:
+        with open(path, "rb") as f:
+            payload = f.read()
+        if args.base64:
+            payload = base64.b64decode(payload)
+        for record in records(payload):
+            print(json.dumps(record))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())